@@ -0,0 +1,162 @@
+"""Нагрузочное сравнение доступа к базе из эндпоинтов.
+
+Чтение (--scenario read), режимы:
+    threadpool — как было с sync-эндпоинтами: каждый запрос занимает поток общего пула без лимита;
+    limited    — async-эндпоинты, запросы в отдельном пуле потоков с лимитом DB_CONCURRENCY.
+Нагрузка: параллельные клиенты ищут товары и забирают /sync (мимо кэша ответов),
+часть клиентов всё время логинится — bcrypt медленный и раньше занимал потоки наравне с базой.
+
+Запись (--scenario write), режимы:
+    direct — как было: каждый запрос — своя транзакция и свой commit;
+    queue  — очередь записи с group commit (server.WriteQueue).
+Нагрузка: параллельные клиенты создают товары через POST /items.
+
+База открывается с профилем хранения из db.json (или --profile).
+Приложение вызывается в процессе через ASGI, без сети.
+
+Запуск из папки backend:
+    python bench_db.py [--scenario read|write] [--clients 64] [--seconds 5] [--items 20000]
+                       [--login-every 8] [--profile durable]
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+from typing import Optional
+import httpx
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import create_engine, insert
+from sqlalchemy.orm import sessionmaker
+
+import server
+
+class ThreadpoolDatabase(server.Database):
+    """Прежний путь: sync-код в общем пуле потоков Starlette, без отдельного лимита."""
+
+    async def run(self, fn, *args):
+        return await run_in_threadpool(self._call, fn, args)
+
+class DirectWrites(server.WriteQueue):
+    """Прежний путь записи: каждая операция — своя транзакция и свой commit в общем пуле потоков."""
+
+    async def submit(self, fn, *args):
+        return await run_in_threadpool(self._commit, fn, args)
+
+    def _commit(self, fn, args):
+        with self.session_factory() as db:
+            result = fn(db, *args)
+            db.commit()
+            return result
+
+def seed(session_factory, items: int):
+    with session_factory() as db:
+        db.add(server.Role(name="admin"))
+        db.add(server.Category(name="Категория", unit="шт."))
+        db.flush()
+        db.add(server.User(username="admin", password=server.pwd_context.hash("admin"), full_name="Admin", role_id=1))
+        db.execute(insert(server.Item), [
+            {"name": f"Товар {i}", "category_id": 1, "parameter_value": str(i), "parameter_numeric": float(i), "unit": "шт."}
+            for i in range(items)
+        ])
+        db.commit()
+
+async def client_loop(client, deadline: float, latencies: dict, login: bool, number: int):
+    while time.perf_counter() < deadline:
+        if login is None:
+            name, request = "create", client.post("/items", json={
+                "name": f"Новый товар {number}", "category_id": 1, "parameter_value": str(number), "unit": "шт."
+            })
+        elif login:
+            name, request = "login", client.post("/login", data={"username": "admin", "password": "admin"})
+        elif number % 2:
+            name, request = "search", client.get("/items/search", params={"query": f"товар {number % 100}", "limit": 50})
+        else:
+            name, request = "sync", client.get("/sync", params={"since": number * 10, "limit": 200})
+        started = time.perf_counter()
+        response = await request
+        if response.status_code != 200:
+            raise RuntimeError(f"{name}: HTTP {response.status_code} {response.text}")
+        latencies.setdefault(name, []).append(time.perf_counter() - started)
+        number += 1
+
+async def run_mode(overrides: dict, clients: int, seconds: float, login_every: Optional[int]) -> dict:
+    """login_every=None — сценарий записи."""
+    server.app.dependency_overrides.update(overrides)
+    latencies = {}
+    try:
+        transport = httpx.ASGITransport(app=server.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            deadline = time.perf_counter() + seconds
+            await asyncio.gather(*(
+                client_loop(
+                    client, deadline, latencies,
+                    None if login_every is None else bool(login_every) and number % login_every == 0,
+                    number
+                )
+                for number in range(clients)
+            ))
+    finally:
+        for dependency in overrides:
+            server.app.dependency_overrides.pop(dependency, None)
+    return latencies
+
+def report(mode: str, latencies: dict, seconds: float):
+    for name, values in sorted(latencies.items()):
+        values.sort()
+        p95 = values[int(len(values) * 0.95) - 1] if len(values) > 1 else values[0]
+        print(
+            f"{mode:10} {name:7} {len(values) / seconds:8.1f} req/s"
+            f"  p50 {statistics.median(values) * 1000:7.1f} ms  p95 {p95 * 1000:7.1f} ms"
+        )
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scenario", choices=["read", "write"], default="read")
+    parser.add_argument("--clients", type=int, default=64)
+    parser.add_argument("--seconds", type=float, default=5)
+    parser.add_argument("--items", type=int, default=20000)
+    parser.add_argument("--login-every", type=int, default=8, help="каждый N-й клиент логинится; 0 — без логинов")
+    parser.add_argument("--profile", help="пресет профиля хранения вместо storage_profile из db.json")
+    args = parser.parse_args()
+    profile = server.resolve_storage_profile(args.profile) if args.profile else server.STORAGE_PROFILE
+    if profile.get("read_only"):
+        parser.error("профиль только для чтения не подходит для замера")
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, "bench.db")
+        engine = create_engine(f"sqlite:///{path}", connect_args={"check_same_thread": False})
+        server.configure_storage(engine, profile)
+        session_factory = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+        server.init_db(engine)
+        seed(session_factory, args.items)
+
+        print(f"storage profile: {profile['preset']}")
+
+        database = server.Database(session_factory)
+        if args.scenario == "write":
+            login_every = None
+            modes = {
+                "direct": {server.get_database: lambda: database, server.get_write_queue: lambda: DirectWrites(session_factory)},
+                "queue": {server.get_database: lambda: database, server.get_write_queue: lambda: write_queue},
+            }
+            write_queue = server.WriteQueue(session_factory)
+        else:
+            login_every = args.login_every
+            threadpool = ThreadpoolDatabase(session_factory)
+            modes = {
+                "threadpool": {server.get_database: lambda: threadpool},
+                "limited": {server.get_database: lambda: database},
+            }
+
+        try:
+            for mode, overrides in modes.items():
+                report(mode, asyncio.run(run_mode(overrides, args.clients, args.seconds, login_every)), args.seconds)
+        finally:
+            engine.dispose()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
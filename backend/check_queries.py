@@ -0,0 +1,105 @@
+"""Проверка эндпоинтов на N+1: число SQL-запросов не должно расти вместе с объёмом данных.
+
+Каждый списочный эндпоинт вызывается на маленькой и на большой временной базе,
+запросы считаются через события SQLAlchemy (server.QueryCounter).
+Если на большой базе запросов больше, скрипт завершается с кодом 1.
+
+Запуск из папки backend:
+    python check_queries.py
+"""
+import os
+import sys
+import tempfile
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+import server
+
+# Размеры наборов данных; оба помещаются в одну страницу /items
+SMALL_SIZE = 3
+LARGE_SIZE = 30
+
+LIST_ENDPOINTS = [
+    "/roles",
+    "/users",
+    "/categories",
+    "/items",
+    "/items?category_id=1",
+    "/items?category_id=1&facets=true",
+    "/items?sort=name",
+    "/items/search?query=товар",
+    "/sync",
+]
+
+def seed(session_factory, size: int):
+    with session_factory() as db:
+        roles = [server.Role(name=f"Роль {i}") for i in range(size)]
+        categories = [server.Category(name=f"Категория {i}", unit="шт.") for i in range(size)]
+        db.add_all(roles + categories)
+        db.flush()
+        db.add_all(
+            server.User(username=f"user{i}", password="-", full_name=f"Пользователь {i}", role_id=roles[i].id)
+            for i in range(size)
+        )
+        db.add_all(
+            server.Item(
+                name=f"Товар {i}",
+                category_id=categories[0].id,
+                parameter_value=str(i),
+                parameter_numeric=float(i),
+                unit="шт."
+            )
+            for i in range(size)
+        )
+        db.commit()
+
+def count_queries(size: int) -> dict:
+    """Возвращает {эндпоинт: число SQL-запросов} на временной базе с size строками в каждой таблице."""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        engine = create_engine(f"sqlite:///{os.path.join(tmp_dir, 'check.db')}", connect_args={"check_same_thread": False})
+        session_factory = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+        server.init_db(engine)
+        seed(session_factory, size)
+
+        def get_test_db():
+            db = session_factory()
+            try:
+                yield db
+            finally:
+                db.close()
+
+        server.app.dependency_overrides[server.get_db] = get_test_db
+        # async-эндпоинты ходят в базу через server.Database; считаем запросы sync-пути на том же engine
+        server.app.dependency_overrides[server.get_database] = lambda: server.Database(session_factory)
+        # Иначе второй прогон получит ответы первого из кэша
+        server.response_cache.clear()
+        counts = {}
+        try:
+            client = TestClient(server.app)
+            for endpoint in LIST_ENDPOINTS:
+                with server.QueryCounter(engine) as counter:
+                    response = client.get(endpoint)
+                if response.status_code != 200:
+                    raise RuntimeError(f"{endpoint}: HTTP {response.status_code} {response.text}")
+                counts[endpoint] = counter.count
+        finally:
+            server.app.dependency_overrides.pop(server.get_db, None)
+            server.app.dependency_overrides.pop(server.get_database, None)
+            engine.dispose()
+        return counts
+
+def main() -> int:
+    small = count_queries(SMALL_SIZE)
+    large = count_queries(LARGE_SIZE)
+
+    failed = False
+    for endpoint in LIST_ENDPOINTS:
+        grows = large[endpoint] > small[endpoint]
+        failed = failed or grows
+        status = "FAIL" if grows else "ok"
+        print(f"{status:4} {endpoint:40} {small[endpoint]:3} -> {large[endpoint]:3} queries")
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
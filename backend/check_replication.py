@@ -0,0 +1,76 @@
+"""Проверка репликации на двух временных базах: после обмена журналами базы совпадают.
+
+Сценарии:
+    одноимённые строки, созданные в обеих базах, сливаются в одну с одинаковым uid;
+    товар, созданный в чужой «копии» категории, попадает в общую категорию;
+    переименование после слияния доходит до второй базы, дублей не остаётся;
+    повторный обмен ничего не меняет.
+Если базы расходятся, скрипт завершается с кодом 1.
+
+Запуск из папки backend:
+    python check_replication.py
+"""
+import os
+import sys
+import tempfile
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+import server
+import replicate
+
+def snapshot(engine) -> dict:
+    """Содержимое базы без локальных id: по uid и ссылкам через uid."""
+    with Session(engine) as db:
+        categories = {row.uid: (row.name, row.unit) for row in db.execute(select(server.Category)).scalars()}
+        items = {
+            item.uid: (item.name, item.category.uid if item.category else None)
+            for item in db.execute(select(server.Item)).scalars()
+        }
+    return {"categories": categories, "items": items}
+
+def exchange(engine_a, engine_b):
+    replicate.transfer(engine_a, engine_b)
+    replicate.transfer(engine_b, engine_a)
+
+def check(name: str, engine_a, engine_b, expected_categories: int = 1) -> bool:
+    a, b = snapshot(engine_a), snapshot(engine_b)
+    ok = a == b and len(a["categories"]) == expected_categories
+    print(f"{'ok' if ok else 'FAIL':4} {name}")
+    if not ok:
+        print(f"     A: {a}\n     B: {b}")
+    return ok
+
+def main() -> int:
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        engine_a = replicate.open_db(os.path.join(tmp_dir, "a.db"))
+        engine_b = replicate.open_db(os.path.join(tmp_dir, "b.db"))
+        results = []
+        try:
+            for engine, item_name in ((engine_a, "Кабель ВВГ"), (engine_b, "Кабель ПВС")):
+                with Session(engine) as db:
+                    category = server.Category(name="Кабель", unit="м")
+                    db.add(category)
+                    db.flush()
+                    db.add(server.Item(name=item_name, category_id=category.id, unit="м"))
+                    db.commit()
+
+            exchange(engine_a, engine_b)
+            results.append(check("одноимённые категории слиты", engine_a, engine_b))
+
+            with Session(engine_a) as db:
+                db.execute(select(server.Category)).scalar_one().name = "Кабель силовой"
+                db.commit()
+            exchange(engine_a, engine_b)
+            results.append(check("переименование после слияния", engine_a, engine_b))
+
+            before = snapshot(engine_a)
+            exchange(engine_a, engine_b)
+            results.append(check("повторный обмен", engine_a, engine_b) and snapshot(engine_a) == before)
+        finally:
+            engine_a.dispose()
+            engine_b.dispose()
+    return 0 if all(results) else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,109 @@
+"""Репликация между магазинами файлами журнала изменений, без сети.
+
+Каждая база ведёт журнал changelog (см. server.init_replication). Пачка журнала
+выгружается в файл, переносится в другой магазин и применяется там; повторное
+применение того же файла ничего не меняет. При конфликте побеждает изменение
+с большей версией (часы Лэмпорта), при равенстве — с большим id базы.
+
+Запуск из папки backend:
+    python replicate.py export shop.db changes.jsonl.gz [--since SEQ]
+    python replicate.py apply shop.db changes.jsonl.gz
+    python replicate.py sync shop_a.db shop_b.db
+Без --since выгружается всё после seq, уже применённого в базе --peer (если указана).
+"""
+import argparse
+import sys
+from sqlalchemy import create_engine, select
+
+import server
+
+def open_db(path: str):
+    engine = create_engine(f"sqlite:///{path}")
+    server.init_db(engine)
+    return engine
+
+def database_id(connection) -> str:
+    return connection.execute(select(server.SyncRevision.database_id).where(server.SyncRevision.id == 1)).scalar()
+
+def applied_seq(connection, source: str) -> int:
+    return connection.execute(
+        select(server.ReplicationPeer.last_seq).where(server.ReplicationPeer.source == source)
+    ).scalar() or 0
+
+def export(engine, since: int) -> tuple:
+    with engine.connect() as connection:
+        entries = server.read_changelog(connection, since)
+        return database_id(connection), entries
+
+def apply(engine, source: str, entries: list) -> dict:
+    with engine.begin() as connection:
+        return server.apply_changelog(connection, source, entries)
+
+def print_report(report: dict):
+    print(f"{report['source']}: applied {report['applied']}, skipped {report['skipped']}, last seq {report['last_seq']}")
+    for conflict in report["conflicts"]:
+        print(f"  conflict at seq {conflict['seq']}: {conflict['entity']} {conflict['uid']}: {conflict['reason']}")
+
+def transfer(source_engine, target_engine):
+    """Переносит все ещё не применённые изменения source в target пачками."""
+    with target_engine.connect() as connection:
+        own_id = database_id(connection)
+    while True:
+        with source_engine.connect() as connection:
+            source_id = database_id(connection)
+        with target_engine.connect() as connection:
+            since = applied_seq(connection, source_id)
+        source_id, entries = export(source_engine, since)
+        if not entries:
+            return
+        report = apply(target_engine, source_id, entries)
+        print(f"-> {own_id}: ", end="")
+        print_report(report)
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    export_parser = commands.add_parser("export", help="выгрузить пачку журнала в файл")
+    export_parser.add_argument("db")
+    export_parser.add_argument("file")
+    export_parser.add_argument("--since", type=int)
+    export_parser.add_argument("--peer", help="база магазина-получателя: выгрузить только то, чего в ней нет")
+
+    apply_parser = commands.add_parser("apply", help="применить файл журнала")
+    apply_parser.add_argument("db")
+    apply_parser.add_argument("file")
+
+    sync_parser = commands.add_parser("sync", help="обменяться изменениями между двумя базами")
+    sync_parser.add_argument("db_a")
+    sync_parser.add_argument("db_b")
+
+    args = parser.parse_args()
+
+    if args.command == "export":
+        engine = open_db(args.db)
+        since = args.since or 0
+        if args.since is None and args.peer:
+            with engine.connect() as connection:
+                source_id = database_id(connection)
+            with open_db(args.peer).connect() as connection:
+                since = applied_seq(connection, source_id)
+        source_id, entries = export(engine, since)
+        with open(args.file, "wb") as batch_file:
+            batch_file.write(server.encode_changelog_batch(source_id, entries))
+        print(f"{source_id}: exported {len(entries)} changes after seq {since}")
+    elif args.command == "apply":
+        with open(args.file, "rb") as batch_file:
+            header, entries = server.decode_changelog_batch(batch_file.read())
+        report = apply(open_db(args.db), header["source"], entries)
+        print_report(report)
+        if report["conflicts"]:
+            return 1
+    else:
+        engine_a, engine_b = open_db(args.db_a), open_db(args.db_b)
+        transfer(engine_a, engine_b)
+        transfer(engine_b, engine_a)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,20 +1,61 @@
+import io
+import csv
 import json
 import os
 import logging
 import uuid
+import re
+import base64
+import bisect
+import threading
+import asyncio
+import time
+import zlib
 import hashlib
-from typing import List, Optional
-from fastapi import FastAPI, Depends, HTTPException, UploadFile, File
-from fastapi.responses import FileResponse
+import gzip
+import shutil
+import mmap
+import struct
+import queue
+from collections import OrderedDict, namedtuple, deque
+from concurrent.futures import ThreadPoolExecutor, Future
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional, Union
+from urllib.request import pathname2url
+import anyio
+from fastapi import FastAPI, Depends, HTTPException, UploadFile, File, Query, Form, Request, Header
+from fastapi.responses import StreamingResponse, JSONResponse, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.middleware.gzip import GZipMiddleware
 from fastapi.security import OAuth2PasswordRequestForm
 import bcrypt
 import passlib
 from passlib.context import CryptContext
-from pydantic import BaseModel
-from sqlalchemy import create_engine, Column, Integer, String, ForeignKey
+from pydantic import BaseModel, Field, ValidationError
+from sqlalchemy import create_engine, event, select, Column, Integer, String, Float, DateTime, ForeignKey, Index, tuple_, text, func, inspect, insert, update, delete
+from sqlalchemy.exc import OperationalError
 from sqlalchemy.orm import declarative_base
 from sqlalchemy.orm import Session, sessionmaker, relationship
 
+# Необязательные ускорители: без них сервер работает на стандартных json и gzip
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+try:
+    from brotli_asgi import BrotliMiddleware
+except ImportError:
+    BrotliMiddleware = None
+# Без Pillow картинки хранятся как загружены, без миниатюр и перекодирования
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None
+
 # Logger setup
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -25,25 +66,614 @@ IMGS_DIR = os.path.join(SERVER_DIR, "Imgs")
 CONFIG_PATH = os.path.join(SERVER_DIR, "db.json")
 DEFAULT_DB_PATH = os.path.join(SERVER_DIR, "back.db")
 DEFAULT_IMAGE_PATH = os.path.join(os.path.dirname(__file__), "default.jpg")
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+MAX_FACET_VALUES = 100
+IMPORT_CHUNK_SIZE = 1000
+# Сколько помнить ключи Idempotency-Key применённых изменений: клиент повторяет запрос,
+# ответ на который потерялся, при следующей отправке своей очереди
+IDEMPOTENCY_TTL_SECONDS = 7 * 24 * 3600
+MAX_IMPORT_ERRORS = 1000
+# После большого импорта индекс подсказок дешевле перестроить целиком
+SUGGEST_REBUILD_THRESHOLD = 1000
+EXPORT_BATCH_SIZE = 1000
+# Ответы меньше этого размера не сжимаются: заголовки и CPU дороже выигрыша
+COMPRESSION_MIN_SIZE = 1024
+MSGPACK_MEDIA_TYPE = "application/msgpack"
+CACHE_MAX_ENTRIES = 256
+CACHE_MAX_BYTES = 32 * 1024 * 1024
+CACHE_TTL_SECONDS = 300
+# Списки всегда перепроверяются по ETag; картинки по id не меняются
+LIST_CACHE_CONTROL = "no-cache"
+IMAGE_CACHE_CONTROL = "public, max-age=86400"
+# Горячие картинки держим в памяти целиком, если они не больше IMAGE_INLINE_MAX_SIZE;
+# для остальных кэшируются только путь и ETag, а отдаются они через mmap
+IMAGE_CACHE_MAX_ENTRIES = 4096
+IMAGE_CACHE_MAX_BYTES = 64 * 1024 * 1024
+IMAGE_INLINE_MAX_SIZE = 256 * 1024
+IMAGE_STREAM_CHUNK_SIZE = 1024 * 1024
+# Пачка миниатюр одним ответом: 4 байта длины JSON-оглавления, оглавление, затем байты картинок
+IMAGE_BUNDLE_MEDIA_TYPE = "application/x-image-bundle"
+MAX_BUNDLE_IMAGES = 200
+# Байты в пачку кладутся только у картинок, которые держатся в памяти (не больше IMAGE_INLINE_MAX_SIZE),
+# и пока пачка не больше MAX_BUNDLE_SIZE; остальные попадают в оглавление без байтов
+MAX_BUNDLE_SIZE = 8 * 1024 * 1024
+# Лента изменений /events: сколько последних событий помнить для переподключения,
+# очередь на одного подписчика и интервал пустых строк, чтобы прокси не рвали соединение
+EVENTS_HISTORY_SIZE = 1000
+EVENTS_QUEUE_SIZE = 1000
+EVENTS_KEEPALIVE_SECONDS = 15
+IMAGE_MEDIA_TYPES = {"webp": "image/webp", "jpg": "image/jpeg", "png": "image/png", "gif": "image/gif"}
+# Производные картинок: наибольшая сторона в пикселях (thumb — карточки 120×120 на экранах 2x)
+IMAGE_SIZES = {"thumb": 240, "preview": 800}
+IMAGE_QUALITY = 80
+IMAGE_WORKERS = 2
+# Сигнатуры форматов, которые принимает /upload_image
+IMAGE_SIGNATURES = [
+    (b"\xff\xd8\xff", "jpg"),
+    (b"\x89PNG\r\n\x1a\n", "png"),
+    (b"GIF87a", "gif"),
+    (b"GIF89a", "gif"),
+]
+IMAGE_EXTENSIONS = ["webp", "jpg", "png", "gif"]
+# id картинки — SHA-256 содержимого; файлы раскладываются по Imgs/ab/cd/<id>.*
+IMAGE_ID_RE = re.compile(r"[0-9a-f]{64}")
+IMAGE_FILE_RE = re.compile(r"([\w-]+?)(?:_(thumb|preview))?\.(webp|jpg|png|gif)")
+# Картинку без ссылок удаляем не сразу: её могли только что загрузить под новый товар
+IMAGE_GC_GRACE_SECONDS = 3600
+# Загрузка пишется на диск кусками, целиком в памяти не держится
+UPLOAD_CHUNK_SIZE = 256 * 1024
+DEFAULT_MAX_IMAGE_SIZE = 20 * 1024 * 1024
+MAX_UPLOAD_FILES = 200
+# Лимит тела всего запроса /upload_images и запас на заголовки multipart у /upload_image
+DEFAULT_MAX_UPLOAD_REQUEST_SIZE = 256 * 1024 * 1024
+UPLOAD_FORM_OVERHEAD = 64 * 1024
+# Сколько запросов к базе выполняется одновременно; остальные ждут в очереди, не занимая потоки
+DEFAULT_DB_CONCURRENCY = 8
+# Очередь записи: сколько операций ждут писателя, сколько входит в одну транзакцию
+# и сколько писатель ждёт попутчиков для пачки после первой операции
+WRITE_QUEUE_SIZE = 1000
+WRITE_BATCH_SIZE = 200
+WRITE_BATCH_WINDOW = 0.002
+
+# Профили хранения SQLite: прагмы выполняются на каждом новом соединении.
+# throughput — быстрее запись (synchronous=NORMAL: в WAL при сбое питания теряются последние
+# транзакции, но база не портится), durable — fsync на каждый commit, kiosk — только чтение
+# неизменяемого файла (копии базы, которую никто не пишет): без блокировок и журнала.
+STORAGE_PRESETS = {
+    "durable": {
+        "journal_mode": "wal", "synchronous": "full", "cache_size": -16384,
+        "mmap_size": 0, "temp_store": "default", "busy_timeout": 10000,
+    },
+    "throughput": {
+        "journal_mode": "wal", "synchronous": "normal", "cache_size": -65536,
+        "mmap_size": 256 * 1024 * 1024, "temp_store": "memory", "busy_timeout": 5000,
+    },
+    "kiosk": {
+        "read_only": True, "immutable": True, "cache_size": -65536,
+        "mmap_size": 256 * 1024 * 1024, "temp_store": "memory",
+    },
+}
+DEFAULT_STORAGE_PRESET = "durable"
+STORAGE_PRAGMAS = ("journal_mode", "synchronous", "cache_size", "mmap_size", "temp_store", "busy_timeout")
+STORAGE_PRAGMA_VALUE_RE = re.compile(r"^(-?\d+|[A-Za-z]+)$")
+# POST-запросы, которые в режиме только для чтения разрешены: они ничего не пишут
+READ_ONLY_POST_PATHS = {"/login", "/imgs/bundle"}
+# Меняется при каждом запуске: счётчики ревизий живут в памяти и после рестарта начинаются заново
+BOOT_ID = uuid.uuid4().hex
+EXPORT_COLUMNS = ["id", "name", "category_id", "category", "parameter_value", "unit", "image_id", "updated_at"]
+# Число в начале значения параметра: "2,5", "2.5 мм²", "16А"; "3x2.5" числом не считается
+PARAMETER_NUMBER_RE = re.compile(r"^\s*([-+]?\d+(?:[.,]\d+)?)\s*([^\d\s][^\d]*)?$")
+DEFAULT_SUGGEST_LIMIT = 10
+SYNC_PAGE_SIZE = 1000
+CHANGELOG_BATCH_SIZE = 10000
+MAX_SYNC_PAGE_SIZE = 10000
+ITEM_SORT_COLUMNS = {"id": ("id",), "name": ("name", "id")}
+RUSSIAN_ENDINGS = sorted(
+    ["ами", "ями", "ого", "его", "ому", "ему", "ыми", "ими", "ых", "их", "ах", "ях", "ов", "ев",
+     "ей", "ий", "ый", "ой", "ая", "яя", "ое", "ее", "ые", "ие", "ую", "юю", "ом", "ем", "ам", "ям",
+     "ы", "и", "а", "я", "о", "е", "у", "ю", "ь"],
+    key=len, reverse=True
+)
 
 os.makedirs(SERVER_DIR, exist_ok=True)
 os.makedirs(IMGS_DIR, exist_ok=True)
 
+def load_config() -> dict:
+    """Настройки сервера из db.json; без файла — пустой словарь."""
+    try:
+        with open(CONFIG_PATH, "r") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+# Лимит размера одной картинки, переопределяется ключом max_image_size в db.json
+MAX_IMAGE_SIZE = int(load_config().get("max_image_size", DEFAULT_MAX_IMAGE_SIZE))
+# Лимит тела пакетной загрузки картинок, ключ max_upload_request_size в db.json
+MAX_UPLOAD_REQUEST_SIZE = int(load_config().get("max_upload_request_size", DEFAULT_MAX_UPLOAD_REQUEST_SIZE))
+# Лимит одновременных запросов к базе из async-эндпоинтов, ключ db_concurrency в db.json
+DB_CONCURRENCY = int(load_config().get("db_concurrency", DEFAULT_DB_CONCURRENCY))
+
+def resolve_storage_profile(setting) -> dict:
+    """Профиль из ключа storage_profile в db.json.
+
+    Значение — имя пресета ("throughput") или словарь с пресетом и переопределёнными
+    прагмами: {"preset": "throughput", "cache_size": -131072}.
+    """
+    if setting is None:
+        setting = DEFAULT_STORAGE_PRESET
+    overrides = {"preset": setting} if isinstance(setting, str) else dict(setting)
+    preset = overrides.pop("preset", DEFAULT_STORAGE_PRESET)
+    if preset not in STORAGE_PRESETS:
+        raise ValueError(f"Unknown storage preset: {preset}")
+
+    profile = dict(STORAGE_PRESETS[preset], **overrides)
+    for name, value in profile.items():
+        if name in ("read_only", "immutable"):
+            continue
+        if name not in STORAGE_PRAGMAS:
+            raise ValueError(f"Unknown storage setting: {name}")
+        # Значение подставляется в текст PRAGMA, поэтому только числа и слова
+        if not STORAGE_PRAGMA_VALUE_RE.match(str(value)):
+            raise ValueError(f"Invalid value for {name}: {value}")
+    profile["preset"] = preset
+    return profile
+
+def sqlite_url(path: str, profile: dict) -> str:
+    path = os.path.abspath(path)
+    if not profile.get("read_only"):
+        return f"sqlite:///{path}"
+    # Режим только для чтения задаётся в URI; immutable=1 — файл не меняется, блокировки не нужны
+    params = "mode=ro&immutable=1" if profile.get("immutable") else "mode=ro"
+    return f"sqlite:///file:{pathname2url(path)}?{params}&uri=true"
+
+def configure_storage(engine, profile: dict):
+    """Выставляет прагмы профиля на каждом новом соединении engine."""
+    def apply_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name in STORAGE_PRAGMAS:
+            value = profile.get(name)
+            # Режим журнала у файла только для чтения не меняется
+            if value is None or (name == "journal_mode" and profile.get("read_only")):
+                continue
+            cursor.execute(f"PRAGMA {name} = {value}")
+        cursor.close()
+
+    event.listen(engine, "connect", apply_pragmas)
+
+STORAGE_PROFILE = resolve_storage_profile(load_config().get("storage_profile"))
+
 # Database configuration
 Base = declarative_base()
-engine = create_engine(f"sqlite:///{os.path.abspath(DEFAULT_DB_PATH)}", connect_args={"check_same_thread": False})
+engine = create_engine(sqlite_url(DEFAULT_DB_PATH, STORAGE_PROFILE), connect_args={"check_same_thread": False})
+configure_storage(engine, STORAGE_PROFILE)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 # Security
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
-app = FastAPI()
+# Responses
+class FastJSONResponse(JSONResponse):
+    """JSON через orjson, если он установлен; иначе стандартный JSONResponse."""
+
+    def render(self, content) -> bytes:
+        if orjson is None:
+            return super().render(content)
+        return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS)
+
+class MessagePackResponse(Response):
+    media_type = MSGPACK_MEDIA_TYPE
+
+    def render(self, content) -> bytes:
+        return msgpack.packb(content, use_bin_type=True, default=str)
+
+def wants_msgpack(request: Request) -> bool:
+    return msgpack is not None and MSGPACK_MEDIA_TYPE in request.headers.get("accept", "")
+
+def api_response(request: Request, content):
+    """Отдаёт MessagePack, если клиент его просит в Accept и msgpack установлен, иначе JSON."""
+    if wants_msgpack(request):
+        return MessagePackResponse(content)
+    return FastJSONResponse(content)
+
+# Response cache
+CacheEntry = namedtuple("CacheEntry", ["expires_at", "tags", "body", "media_type"])
+
+class ResponseCache:
+    """LRU-кэш уже сериализованных ответов с TTL и инвалидацией по тегам.
+
+    Теги: "categories", "roles", "users", "items:all" и "items:<category_id>".
+    Каждая инвалидация увеличивает generation; ответ, собранный до неё, в кэш не кладётся,
+    чтобы чтение, шедшее параллельно с записью, не сохранило устаревшие данные.
+    """
+
+    def __init__(self, max_entries: int, max_bytes: int, ttl: float):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.generation = 0
+        self.hits = self.misses = self.evictions = self.invalidations = 0
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def _drop(self, key):
+        entry = self._entries.pop(key)
+        self._bytes -= len(entry.body)
+
+    def get(self, key) -> Optional[CacheEntry]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.expires_at < time.monotonic():
+                self._drop(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key, tags, body: bytes, media_type: str, generation: int):
+        with self._lock:
+            if generation != self.generation or len(body) > self.max_bytes:
+                return
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = CacheEntry(time.monotonic() + self.ttl, frozenset(tags), body, media_type)
+            self._bytes += len(body)
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._drop(next(iter(self._entries)))
+                self.evictions += 1
+
+    def invalidate(self, *tags):
+        tags = set(tags)
+        with self._lock:
+            self.generation += 1
+            for key in [key for key, entry in self._entries.items() if entry.tags & tags]:
+                self._drop(key)
+                self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self.generation += 1
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
+
+response_cache = ResponseCache(CACHE_MAX_ENTRIES, CACHE_MAX_BYTES, CACHE_TTL_SECONDS)
+
+ImageEntry = namedtuple("ImageEntry", ["path", "etag", "data", "final"])
+
+class ImageCache:
+    """LRU найденных картинок по ключу (image_id, size): путь, ETag и байты небольших файлов.
+
+    Вытеснение по суммарному размеру байтов в памяти и по числу записей.
+    Записи картинки сбрасываются через discard при загрузке, обработке и удалении её файлов;
+    discard увеличивает поколение картинки, и put с поколением, прочитанным до поиска файлов,
+    не сохраняет запись, если файлы за это время изменились.
+    """
+
+    def __init__(self, max_entries: int, max_bytes: int):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = self.misses = self.evictions = 0
+        self._entries = OrderedDict()
+        self._bytes = 0
+        # Поколения по image_id: одно число на картинку, файлы которой менялись
+        self._generations = {}
+        self._lock = threading.Lock()
+
+    def _drop(self, key):
+        entry = self._entries.pop(key)
+        if entry.data is not None:
+            self._bytes -= len(entry.data)
+
+    def get(self, key) -> Optional[ImageEntry]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def generation(self, image_id: str) -> int:
+        with self._lock:
+            return self._generations.get(image_id, 0)
+
+    def put(self, key, entry: ImageEntry, generation: Optional[int] = None):
+        with self._lock:
+            if generation is not None and self._generations.get(key[0], 0) != generation:
+                return
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = entry
+            if entry.data is not None:
+                self._bytes += len(entry.data)
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._drop(next(iter(self._entries)))
+                self.evictions += 1
+
+    def discard(self, image_id: str):
+        with self._lock:
+            self._generations[image_id] = self._generations.get(image_id, 0) + 1
+            for key in [key for key in self._entries if key[0] == image_id]:
+                self._drop(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+            }
+
+image_cache = ImageCache(IMAGE_CACHE_MAX_ENTRIES, IMAGE_CACHE_MAX_BYTES)
+
+def etag_matches(request: Request, etag: str) -> bool:
+    """Сравнение If-None-Match с ETag (слабое, как требует RFC 9110 для If-None-Match)."""
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    candidates = [value.strip() for value in header.split(",")]
+    return "*" in candidates or etag in (value[2:] if value.startswith("W/") else value for value in candidates)
+
+def not_modified(etag: str, cache_control: str) -> Response:
+    return Response(status_code=304, headers={"ETag": etag, "Cache-Control": cache_control})
+
+class SingleFlight:
+    """Объединяет одинаковые параллельные вычисления: первый запрос считает, остальные ждут его результат.
+
+    Вычисление идёт отдельной задачей в цикле событий сервера, ожидающие не занимают потоков.
+    Ошибка вычисления достаётся всем ожидающим; отмена любого из запросов, в том числе первого
+    (клиент отключился), общее вычисление не отменяет.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self.coalesced = 0
+
+    async def do(self, key, fn):
+        """fn — корутинная функция; одновременные вызовы с тем же key получают её результат."""
+        # Задача принадлежит своему циклу событий: в другом цикле (тесты) её ждать нельзя
+        key = (asyncio.get_running_loop(), key)
+        task = self._calls.get(key)
+        if task is None:
+            task = self._calls[key] = asyncio.create_task(fn())
+            task.add_done_callback(lambda done: self._forget(key, done))
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(task)
+
+    def _forget(self, key, task: asyncio.Task):
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        # Ошибку забираем сами: без ожидающих asyncio иначе предупредит о непрочитанном исключении
+        if not task.cancelled():
+            task.exception()
+
+    def in_flight(self) -> int:
+        return len(self._calls)
+
+request_flights = SingleFlight()
+
+def read_data_revision(db: Session) -> tuple:
+    """id базы и её счётчик ревизий из sync_revision.
+
+    Счётчик увеличивают триггеры при любой записи, в том числе из других процессов
+    (replicate.py, вторая копия сервера), поэтому ETag и ключ кэша от него не устаревают.
+    """
+    row = db.execute(select(SyncRevision.database_id, SyncRevision.value).where(SyncRevision.id == 1)).first()
+    return tuple(row) if row else (None, 0)
+
+def lookup_cached_response(request: Request, revision: tuple):
+    """Ключ кэша, заголовки и готовый ответ (304 или из кэша), если строить его не нужно."""
+    key = (request.url.path, tuple(sorted(request.query_params.multi_items())), wants_msgpack(request), revision)
+    # Ревизию берём до построения ответа: если запись случится во время build(),
+    # ETag окажется старым и следующий запрос просто получит 200 со свежими данными
+    etag_source = f"{key}"
+    etag = f'"{hashlib.sha1(etag_source.encode()).hexdigest()}"'
+    headers = {"ETag": etag, "Cache-Control": LIST_CACHE_CONTROL}
+    if etag_matches(request, etag):
+        return key, headers, not_modified(etag, LIST_CACHE_CONTROL)
+
+    entry = response_cache.get(key)
+    if entry is not None:
+        return key, headers, Response(content=entry.body, media_type=entry.media_type, headers=headers)
+    return key, headers, None
+
+async def cached_db_response(request: Request, tags, database: "Database", build):
+    """Отдаёт ответ из кэша или строит его через build(db) и кэширует готовые байты.
+
+    В базу идём только при промахе кэша; одинаковые запросы, пришедшие одновременно,
+    ждут один общий build. В ключ входит generation кэша: после записи новые запросы
+    не присоединяются к вычислению, начатому до неё, и не получают устаревших данных.
+    """
+    revision = await database.run(read_data_revision)
+    key, headers, cached = lookup_cached_response(request, revision)
+    if cached is not None:
+        return cached
+
+    generation = response_cache.generation
+
+    async def load():
+        content = await database.run(build)
+        response = api_response(request, content)
+        response_cache.put(key, tags, response.body, response.media_type, generation)
+        return response.body, response.media_type
+
+    body, media_type = await request_flights.do((key, generation), load)
+    return Response(content=body, media_type=media_type, headers=headers)
+
+def item_cache_tags(category_ids) -> list:
+    return ["items:all"] + [f"items:{category_id}" for category_id in category_ids]
+
+class ChangeFeed:
+    """Рассылка событий об изменениях подписчикам /events.
+
+    Событие: {"entity", "op", "id", "revision"} и для create/update — "data" с новой строкой.
+    op="reset" означает, что изменилось слишком много (импорт) и список надо перечитать целиком.
+    publish() вызывается из потоков обработчиков, подписчики — очереди asyncio в цикле сервера.
+    """
+
+    def __init__(self, history_size: int, queue_size: int):
+        self.revision = 0
+        self.queue_size = queue_size
+        self._history = deque(maxlen=history_size)
+        self._subscribers = {}
+        self._lock = threading.Lock()
+
+    def publish(self, entity: str, op: str, entity_id: Optional[int] = None, data: Optional[dict] = None):
+        with self._lock:
+            self.revision += 1
+            event = {"entity": entity, "op": op, "id": entity_id, "revision": self.revision}
+            if data is not None:
+                event["data"] = data
+            self._history.append(event)
+            subscribers = list(self._subscribers.items())
+        for queue, loop in subscribers:
+            loop.call_soon_threadsafe(self._deliver, queue, event)
+
+    def _deliver(self, queue: asyncio.Queue, event: dict):
+        try:
+            queue.put_nowait(event)
+        except asyncio.QueueFull:
+            # Клиент не успевает читать: вместо потерянных событий — команда перечитать всё
+            while not queue.empty():
+                queue.get_nowait()
+            queue.put_nowait({"entity": None, "op": "reset", "id": None, "revision": event["revision"]})
+
+    def subscribe(self, since: Optional[int]):
+        """Возвращает (очередь, пропущенные события); вместо событий None, если история уже не покрывает since."""
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        with self._lock:
+            self._subscribers[queue] = asyncio.get_running_loop()
+            if since is None:
+                return queue, []
+            if since < self.revision and (not self._history or self._history[0]["revision"] > since + 1):
+                return queue, None
+            return queue, [event for event in self._history if event["revision"] > since]
+
+    def unsubscribe(self, queue: asyncio.Queue):
+        with self._lock:
+            self._subscribers.pop(queue, None)
+
+    def subscribers(self) -> int:
+        with self._lock:
+            return len(self._subscribers)
+
+change_feed = ChangeFeed(EVENTS_HISTORY_SIZE, EVENTS_QUEUE_SIZE)
+
+def format_event(event: dict) -> str:
+    # id содержит BOOT_ID: после перезапуска сервера номера ревизий начинаются заново
+    return f"id: {BOOT_ID}-{event['revision']}\nevent: change\ndata: {json.dumps(event, ensure_ascii=False)}\n\n"
+
+class UploadSizeLimitMiddleware:
+    """Ограничивает тело запросов загрузки до того, как multipart разложен во временные файлы.
+
+    Запрос с Content-Length больше лимита отклоняется сразу, без чтения тела;
+    без Content-Length (chunked) приём обрывается с 413, как только лимит превышен.
+    """
+
+    def __init__(self, app, limits: dict):
+        self.app = app
+        self.limits = limits
+
+    async def __call__(self, scope, receive, send):
+        limit = self.limits.get(scope["path"]) if scope["type"] == "http" else None
+        if limit is None:
+            await self.app(scope, receive, send)
+            return
+        detail = f"Request body is larger than {limit} bytes"
+        content_length = dict(scope["headers"]).get(b"content-length", b"")
+        if content_length.isdigit() and int(content_length) > limit:
+            await JSONResponse({"detail": detail}, status_code=413)(scope, receive, send)
+            return
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    # HTTPException проходит через разбор формы FastAPI и отдаётся как 413
+                    raise HTTPException(status_code=413, detail=detail)
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+app = FastAPI(default_response_class=FastJSONResponse)
+# Картинки и выгрузки уже сжаты или отдаются потоком, /events нельзя буферизовать — их не трогаем
+if BrotliMiddleware is not None:
+    app.add_middleware(
+        BrotliMiddleware,
+        minimum_size=COMPRESSION_MIN_SIZE,
+        gzip_fallback=True,
+        excluded_handlers=[r"^/imgs", r"^/export", r"^/events"]
+    )
+else:
+    app.add_middleware(GZipMiddleware, minimum_size=COMPRESSION_MIN_SIZE)
+app.add_middleware(UploadSizeLimitMiddleware, limits={
+    "/upload_image": MAX_IMAGE_SIZE + UPLOAD_FORM_OVERHEAD,
+    "/upload_images": MAX_UPLOAD_REQUEST_SIZE,
+})
+
+async def reject_writes_when_read_only(request: Request, call_next):
+    # Терминал-киоск работает с неизменяемой копией базы: изменения отклоняем сразу, а не ошибкой SQLite
+    if request.method not in ("GET", "HEAD", "OPTIONS") and request.url.path not in READ_ONLY_POST_PATHS:
+        return JSONResponse({"detail": "Storage is read-only"}, status_code=403)
+    return await call_next(request)
+
+# Только для профиля read_only: http-middleware оборачивает каждый запрос, включая поток /events
+if STORAGE_PROFILE.get("read_only"):
+    app.middleware("http")(reject_writes_when_read_only)
 
 # SQLAlchemy models
+def utc_now() -> datetime:
+    # Время в UTC без tzinfo: SQLite хранит DateTime строкой, формат должен быть единым
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+def new_uid() -> str:
+    # Глобальный id строки для репликации между магазинами: локальные id в разных базах совпадают
+    return uuid.uuid4().hex
+
+# То же на стороне SQLite: uid получают и строки, вставленные сырым SQL мимо ORM
+NEW_UID_SQL = "lower(hex(randomblob(16)))"
+
+# Колонку revision у roles, users, categories и items заполняют триггеры (см. init_sync):
+# любая вставка или изменение строки получает следующий номер из sync_revision,
+# удаление оставляет запись в tombstones. По ним /sync отдаёт изменения после ревизии
 class Role(Base):
     __tablename__ = "roles"
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String, unique=True, index=True)
+    revision = Column(Integer, index=True)
+    uid = Column(String, unique=True, index=True, default=new_uid, server_default=text(f"({NEW_UID_SQL})"))
 
 class User(Base):
     __tablename__ = "users"
@@ -52,6 +682,8 @@ class User(Base):
     password = Column(String)
     full_name = Column(String)
     role_id = Column(Integer, ForeignKey("roles.id"))
+    revision = Column(Integer, index=True)
+    uid = Column(String, unique=True, index=True, default=new_uid, server_default=text(f"({NEW_UID_SQL})"))
     role = relationship("Role")
 
 class Category(Base):
@@ -60,6 +692,8 @@ class Category(Base):
     name = Column(String, unique=True, index=True)
     parameter = Column(String, nullable=True)
     unit = Column(String)
+    revision = Column(Integer, index=True)
+    uid = Column(String, unique=True, index=True, default=new_uid, server_default=text(f"({NEW_UID_SQL})"))
     items = relationship("Item", back_populates="category", cascade="all, delete")
 
 class Item(Base):
@@ -68,10 +702,118 @@ class Item(Base):
     name = Column(String, index=True)
     category_id = Column(Integer, ForeignKey("categories.id"))
     parameter_value = Column(String)
+    # Числовое значение параметра, если parameter_value удалось разобрать как число
+    parameter_numeric = Column(Float, nullable=True)
     unit = Column(String)
     image_id = Column(String, nullable=True)
+    updated_at = Column(DateTime, default=utc_now, onupdate=utc_now, index=True)
+    revision = Column(Integer, index=True)
+    uid = Column(String, unique=True, index=True, default=new_uid, server_default=text(f"({NEW_UID_SQL})"))
     category = relationship("Category", back_populates="items")
 
+    # Индексы под keyset-пагинацию: (category_id, id) и (category_id, name, id),
+    # и под фильтр по диапазону значения параметра внутри категории
+    __table_args__ = (
+        Index("ix_items_category_id_id", "category_id", "id"),
+        Index("ix_items_category_id_name_id", "category_id", "name", "id"),
+        Index("ix_items_name_id", "name", "id"),
+        Index("ix_items_category_id_parameter_numeric", "category_id", "parameter_numeric"),
+        Index("ix_items_image_id", "image_id"),
+    )
+
+ITEM_COLUMNS = (
+    Item.id, Item.name, Item.category_id, Item.parameter_value,
+    Item.parameter_numeric, Item.unit, Item.image_id
+)
+ITEM_FIELDS = [column.key for column in ITEM_COLUMNS]
+
+class Tombstone(Base):
+    __tablename__ = "tombstones"
+    id = Column(Integer, primary_key=True)
+    entity = Column(String, nullable=False)
+    entity_id = Column(Integer, nullable=False)
+    revision = Column(Integer, nullable=False, index=True)
+
+class SyncRevision(Base):
+    """Последняя выданная ревизия: одна строка с id = 1.
+
+    database_id — случайный id базы: по нему клиент понимает, что сервер переключили
+    на другой файл .db и ревизии его реплики больше ничего не значат.
+    """
+    __tablename__ = "sync_revision"
+    id = Column(Integer, primary_key=True)
+    value = Column(Integer, nullable=False, default=0)
+    database_id = Column(String)
+
+class ChangelogEntry(Base):
+    """Журнал изменений для репликации между магазинами; пишется триггерами (см. init_replication).
+
+    version и origin — версия записи по часам Лэмпорта и база, где изменение сделано:
+    при конфликте побеждает изменение с большей (version, origin).
+    """
+    __tablename__ = "changelog"
+    seq = Column(Integer, primary_key=True)
+    entity = Column(String, nullable=False)
+    uid = Column(String, nullable=False)
+    op = Column(String, nullable=False)
+    data = Column(String)
+    version = Column(Integer, nullable=False)
+    origin = Column(String, nullable=False)
+
+    __table_args__ = (
+        Index("ix_changelog_entity_uid_seq", "entity", "uid", "seq"),
+        {"sqlite_autoincrement": True},
+    )
+
+class ReplicationApply(Base):
+    """Пока применяется чужое изменение, здесь лежат его version и origin — их берут триггеры журнала."""
+    __tablename__ = "replication_apply"
+    id = Column(Integer, primary_key=True)
+    origin = Column(String, nullable=False)
+    version = Column(Integer, nullable=False)
+
+class ReplicationPeer(Base):
+    """До какого seq журнала другой базы её изменения уже применены здесь."""
+    __tablename__ = "replication_peers"
+    source = Column(String, primary_key=True)
+    last_seq = Column(Integer, nullable=False)
+
+class ReplicationAlias(Base):
+    """uid строки, слитой с одноимённой строкой другой базы, и uid, под которым она осталась.
+
+    При слиянии обе базы оставляют меньший из двух uid, поэтому приходят к одному и тому же.
+    """
+    __tablename__ = "replication_aliases"
+    entity = Column(String, primary_key=True)
+    uid = Column(String, primary_key=True)
+    target_uid = Column(String, nullable=False)
+
+class AppliedOperation(Base):
+    """Изменение, присланное с ключом Idempotency-Key, и его результат: повтор получает тот же ответ."""
+    __tablename__ = "applied_operations"
+    key = Column(String, primary_key=True)
+    result = Column(String, nullable=False)
+    created_at = Column(DateTime, default=utc_now, index=True)
+
+# Реплицируемые поля; (колонка, таблица) — ссылка, в журнале она хранится как uid строки
+REPLICATION_FIELDS = {
+    "roles": ["name"],
+    "users": ["username", "password", "full_name", ("role_id", "roles")],
+    "categories": ["name", "parameter", "unit"],
+    "items": ["name", ("category_id", "categories"), "parameter_value", "parameter_numeric", "unit", "image_id"],
+}
+# Уникальные имена: строку, созданную в двух магазинах независимо, считаем одной и той же
+REPLICATION_NATURAL_KEYS = {"roles": "name", "users": "username", "categories": "name"}
+REPLICATION_MODELS = {"roles": Role, "users": User, "categories": Category, "items": Item}
+
+# Что отдаёт /sync по каждой таблице; пароли пользователей не синхронизируются
+SYNC_COLUMNS = {
+    "roles": (Role.id, Role.name, Role.revision),
+    "users": (User.id, User.username, User.full_name, User.role_id, User.revision),
+    "categories": (Category.id, Category.name, Category.parameter, Category.unit, Category.revision),
+    "items": ITEM_COLUMNS + (Item.revision,),
+}
+
 # Pydantic schemas
 class RoleBase(BaseModel):
     name: str
@@ -124,10 +866,163 @@ class ItemCreate(ItemBase):
 
 class ItemResponse(ItemCreate):
     id: int
+    parameter_numeric: Optional[float] = None
 
     class Config:
         from_attributes = True
 
+class ItemUpdate(BaseModel):
+    id: int
+    name: Optional[str] = None
+    category_id: Optional[int] = None
+    parameter_value: Optional[str] = None
+    unit: Optional[str] = None
+    image_id: Optional[str] = None
+
+class ItemBatch(BaseModel):
+    create: List[ItemCreate] = []
+    update: List[ItemUpdate] = []
+    delete: List[int] = []
+
+class ItemBatchResult(BaseModel):
+    created: List[ItemResponse]
+    updated: List[ItemResponse]
+    deleted: List[int]
+
+class FacetCount(BaseModel):
+    value: Optional[Union[float, str]]
+    count: int
+    # Для диапазона значений: value — нижняя граница, upper — верхняя (у последнего включительно)
+    upper: Optional[float] = None
+
+class ItemFacets(BaseModel):
+    min: Optional[float] = None
+    max: Optional[float] = None
+    values: List[FacetCount]
+    units: List[FacetCount]
+
+class ItemPage(BaseModel):
+    items: List[ItemResponse]
+    next_cursor: Optional[str] = None
+    facets: Optional[ItemFacets] = None
+
+class ItemImportRow(BaseModel):
+    name: str
+    category: Optional[str] = None
+    category_id: Optional[int] = None
+    parameter_value: str = ""
+    unit: Optional[str] = None
+    image_id: Optional[str] = None
+
+class ImportRowError(BaseModel):
+    row: int
+    error: str
+
+class ImportReport(BaseModel):
+    inserted: int
+    created_categories: List[str]
+    error_count: int
+    errors: List[ImportRowError]
+
+class ImageUploadResult(BaseModel):
+    filename: Optional[str] = None
+    image_id: Optional[str] = None
+    duplicate: bool = False
+    error: Optional[str] = None
+
+class ImageBundleRequest(BaseModel):
+    ids: List[str]
+    # Только производные: оригиналы по 20 МБ пачкой в память не собираем
+    size: str = Field("thumb", pattern="^(thumb|preview)$")
+
+class ReplicationReport(BaseModel):
+    source: str
+    last_seq: int
+    applied: int
+    skipped: int
+    conflicts: List[dict]
+
+class SyncChanges(BaseModel):
+    database: str
+    revision: int
+    more: bool
+    upserts: dict
+    deletes: dict
+
+class Suggestion(BaseModel):
+    text: str
+    kind: str
+    id: int
+
+# Suggest index
+class PrefixIndex:
+    """Индекс автодополнения в памяти.
+
+    Хранит отсортированный список ключей (хвост названия с начала слова, вид, id),
+    поэтому все ключи с заданным префиксом лежат подряд и находятся бинарным поиском.
+    """
+
+    def __init__(self):
+        self._keys = []
+        self._names = {}
+        self._lock = threading.Lock()
+        self.built = False
+
+    @staticmethod
+    def _word_suffixes(name: str) -> set:
+        folded = name.casefold()
+        return {folded[match.start():] for match in re.finditer(r"\w+", folded)}
+
+    def build(self, entries):
+        """entries: итерируемое (вид, id, название)."""
+        keys, names = [], {}
+        for kind, entity_id, name in entries:
+            if not name:
+                continue
+            names[(kind, entity_id)] = name
+            keys.extend((suffix, kind, entity_id) for suffix in self._word_suffixes(name))
+        keys.sort()
+        with self._lock:
+            self._keys, self._names, self.built = keys, names, True
+
+    def add(self, kind: str, entity_id: int, name: str):
+        if not name:
+            return
+        with self._lock:
+            self._names[(kind, entity_id)] = name
+            for suffix in self._word_suffixes(name):
+                bisect.insort(self._keys, (suffix, kind, entity_id))
+
+    def remove(self, kind: str, entity_id: int):
+        with self._lock:
+            name = self._names.pop((kind, entity_id), None)
+            if name is None:
+                return
+            for suffix in self._word_suffixes(name):
+                key = (suffix, kind, entity_id)
+                position = bisect.bisect_left(self._keys, key)
+                if position < len(self._keys) and self._keys[position] == key:
+                    del self._keys[position]
+
+    def complete(self, prefix: str, limit: int) -> list:
+        prefix = prefix.casefold().lstrip()
+        if not prefix:
+            return []
+        result, seen = [], set()
+        with self._lock:
+            position = bisect.bisect_left(self._keys, (prefix,))
+            while position < len(self._keys) and len(result) < limit:
+                suffix, kind, entity_id = self._keys[position]
+                if not suffix.startswith(prefix):
+                    break
+                if (kind, entity_id) not in seen:
+                    seen.add((kind, entity_id))
+                    result.append({"text": self._names[(kind, entity_id)], "kind": kind, "id": entity_id})
+                position += 1
+        return result
+
+suggest_index = PrefixIndex()
+
 # Utility functions
 def get_db_path():
     try:
@@ -138,15 +1033,353 @@ def get_db_path():
         return f"sqlite:///{os.path.abspath(DEFAULT_DB_PATH)}"
 
 def save_db_path(db_path: str):
+    # Остальные настройки в db.json сохраняем
+    config = load_config()
+    config["db_file_path"] = db_path
     with open(CONFIG_PATH, "w") as f:
-        json.dump({"db_file_path": db_path}, f)
+        json.dump(config, f)
+
+def sniff_image_format(header: bytes) -> Optional[str]:
+    """Определяет формат по первым байтам файла, а не по имени."""
+    if header[:4] == b"RIFF" and header[8:12] == b"WEBP":
+        return "webp"
+    for signature, extension in IMAGE_SIGNATURES:
+        if header.startswith(signature):
+            return extension
+    return None
+
+def image_dir(image_id: str) -> str:
+    """Каталог картинки: по два уровня из первых символов хеша, старые uuid-картинки лежат в корне Imgs."""
+    if IMAGE_ID_RE.fullmatch(image_id):
+        return os.path.join(IMGS_DIR, image_id[:2], image_id[2:4])
+    return IMGS_DIR
+
+def image_files(image_id: str) -> list:
+    """Все файлы картинки: оригинал и производные."""
+    directory = image_dir(image_id)
+    names = [f"{image_id}.{extension}" for extension in IMAGE_EXTENSIONS]
+    names += [f"{image_id}_{size}.webp" for size in IMAGE_SIZES]
+    return [os.path.join(directory, name) for name in names if os.path.exists(os.path.join(directory, name))]
+
+def save_image(image_file: UploadFile) -> dict:
+    """Сохраняет картинку под id = SHA-256 содержимого; повторная загрузка того же файла ничего не пишет.
+
+    Файл копируется во временный кусками по UPLOAD_CHUNK_SIZE, хеш считается по ходу записи.
+    """
+    header = image_file.file.read(16)
+    extension = sniff_image_format(header)
+    if not extension:
+        raise HTTPException(status_code=400, detail="Unsupported image format")
+
+    digest = hashlib.sha256(header)
+    size = len(header)
+    tmp_path = os.path.join(IMGS_DIR, f"upload-{uuid.uuid4().hex}.tmp")
+    try:
+        with open(tmp_path, "wb") as buffer:
+            buffer.write(header)
+            for chunk in iter(lambda: image_file.file.read(UPLOAD_CHUNK_SIZE), b""):
+                size += len(chunk)
+                if size > MAX_IMAGE_SIZE:
+                    raise HTTPException(status_code=413, detail=f"Image is larger than {MAX_IMAGE_SIZE} bytes")
+                digest.update(chunk)
+                buffer.write(chunk)
+
+        image_id = digest.hexdigest()
+        existing = image_files(image_id)
+        if existing:
+            # Обновляем mtime, чтобы сборщик мусора не удалил картинку до создания товара
+            for path in existing:
+                os.utime(path)
+            return {"image_id": image_id, "duplicate": True}
+
+        os.makedirs(image_dir(image_id), exist_ok=True)
+        image_path = os.path.join(image_dir(image_id), f"{image_id}.{extension}")
+        os.replace(tmp_path, image_path)
+        # До загрузки по этому id могла отдаваться заглушка
+        image_cache.discard(image_id)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    schedule_image_processing(image_id, image_path)
+    return {"image_id": image_id, "duplicate": False}
 
-def save_image(image_file: UploadFile) -> str:
-    image_id = str(uuid.uuid4())
-    image_path = os.path.join(IMGS_DIR, f"{image_id}.jpg")
-    with open(image_path, "wb") as buffer:
-        buffer.write(image_file.file.read())
-    return image_id
+def save_images(images: list) -> list:
+    """Сохраняет каждую картинку отдельно: ошибка в одном файле попадает в его результат."""
+    results = []
+    for image in images:
+        try:
+            results.append(ImageUploadResult(filename=image.filename, **save_image(image)))
+        except HTTPException as e:
+            results.append(ImageUploadResult(filename=image.filename, error=e.detail))
+    return results
+
+# Image derivatives
+image_pool = ThreadPoolExecutor(max_workers=IMAGE_WORKERS, thread_name_prefix="images")
+_pending_images = set()
+# Картинки, которые Pillow не смог разобрать: отдаём как есть и больше не пытаемся
+_failed_images = set()
+_pending_images_lock = threading.Lock()
+
+def derivative_path(image_id: str, size: Optional[str] = None) -> str:
+    return os.path.join(image_dir(image_id), f"{image_id}_{size}.webp" if size else f"{image_id}.webp")
+
+def save_webp(image, path: str):
+    # Пишем во временный файл и переименовываем, чтобы не отдать недописанную картинку
+    tmp_path = path + ".tmp"
+    image.save(tmp_path, "WEBP", quality=IMAGE_QUALITY, method=4)
+    os.replace(tmp_path, path)
+
+def process_image(image_id: str, source_path: str):
+    """Перекодирует оригинал в WebP без EXIF и строит уменьшенные копии IMAGE_SIZES."""
+    try:
+        with Image.open(source_path) as source:
+            # Поворот по EXIF применяется к пикселям; при сохранении без exif= метаданные отбрасываются
+            image = ImageOps.exif_transpose(source)
+            has_alpha = image.mode in ("RGBA", "LA") or (image.mode == "P" and "transparency" in image.info)
+            image = image.convert("RGBA" if has_alpha else "RGB")
+
+        for size, max_side in IMAGE_SIZES.items():
+            derivative = image.copy()
+            derivative.thumbnail((max_side, max_side), Image.LANCZOS)
+            save_webp(derivative, derivative_path(image_id, size))
+        save_webp(image, derivative_path(image_id))
+        if source_path != derivative_path(image_id):
+            os.remove(source_path)
+        image_cache.discard(image_id)
+    except Exception:
+        logger.exception(f"Failed to process image {image_id}")
+        with _pending_images_lock:
+            _failed_images.add(image_id)
+    finally:
+        with _pending_images_lock:
+            _pending_images.discard(image_id)
+
+def schedule_image_processing(image_id: str, source_path: str):
+    if Image is None:
+        return
+    with _pending_images_lock:
+        if image_id in _pending_images or image_id in _failed_images:
+            return
+        _pending_images.add(image_id)
+    image_pool.submit(process_image, image_id, source_path)
+
+def find_image_file(image_id: str, size: Optional[str] = None):
+    """Возвращает (путь, окончательный ли это вариант) или (None, False).
+
+    Пока производные не готовы, отдаётся оригинал; для старых картинок без
+    производных их построение запускается при первом обращении.
+    """
+    if size and os.path.exists(derivative_path(image_id, size)):
+        return derivative_path(image_id, size), True
+    for extension in IMAGE_EXTENSIONS:
+        path = os.path.join(image_dir(image_id), f"{image_id}.{extension}")
+        if not os.path.exists(path):
+            continue
+        processed = path == derivative_path(image_id) and os.path.exists(derivative_path(image_id, "thumb"))
+        if Image is None or (processed and not size):
+            return path, True
+        if not processed:
+            schedule_image_processing(image_id, path)
+        return path, False
+    return None, False
+
+# Image references
+def remove_image_if_unreferenced(db: Session, image_id: Optional[str], grace: float = IMAGE_GC_GRACE_SECONDS) -> bool:
+    """Счётчик ссылок — число товаров с этим image_id; без ссылок и старше grace файлы удаляются."""
+    if not image_id or image_id == "default":
+        return False
+    if db.query(Item.id).filter(Item.image_id == image_id).first():
+        return False
+    paths = image_files(image_id)
+    if not paths or max(os.path.getmtime(path) for path in paths) > time.time() - grace:
+        return False
+    image_cache.discard(image_id)
+    for path in paths:
+        os.remove(path)
+    return True
+
+def release_images(db: Session, image_ids):
+    removed = sum(remove_image_if_unreferenced(db, image_id) for image_id in set(image_ids))
+    if removed:
+        logger.info(f"Removed {removed} unreferenced images")
+
+def collect_unreferenced_images(db: Session, grace: float = IMAGE_GC_GRACE_SECONDS) -> int:
+    """Полный проход по хранилищу: удаляет картинки, на которые не ссылается ни один товар."""
+    referenced = {image_id for (image_id,) in db.query(Item.image_id).distinct() if image_id}
+    candidates = set()
+    for directory, _, names in os.walk(IMGS_DIR):
+        for name in names:
+            match = IMAGE_FILE_RE.fullmatch(name)
+            if match and match.group(1) not in referenced:
+                candidates.add(match.group(1))
+            elif name.endswith(".tmp"):
+                # Недописанные загрузки после падения сервера
+                path = os.path.join(directory, name)
+                if os.path.getmtime(path) < time.time() - grace:
+                    os.remove(path)
+    return sum(remove_image_if_unreferenced(db, image_id, grace) for image_id in candidates)
+
+def migrate_legacy_images():
+    """Переносит старые картинки Imgs/<uuid>.* в хранилище по хешу и переписывает image_id у товаров.
+
+    Сначала создаются жёсткие ссылки (или копии) на новом месте, затем одной транзакцией
+    обновляется база, и только после commit удаляются старые файлы.
+    """
+    moves, renames = [], {}
+    for name in os.listdir(IMGS_DIR):
+        match = IMAGE_FILE_RE.fullmatch(name)
+        if not match or match.group(2) or IMAGE_ID_RE.fullmatch(match.group(1)):
+            continue
+        legacy_id, extension = match.group(1), match.group(3)
+        legacy_path = os.path.join(IMGS_DIR, name)
+        with open(legacy_path, "rb") as f:
+            image_id = hashlib.sha256(f.read()).hexdigest()
+        renames[legacy_id] = image_id
+
+        targets = [(legacy_path, os.path.join(image_dir(image_id), f"{image_id}.{extension}"))]
+        for size in IMAGE_SIZES:
+            legacy_derivative = os.path.join(IMGS_DIR, f"{legacy_id}_{size}.webp")
+            if os.path.exists(legacy_derivative):
+                targets.append((legacy_derivative, derivative_path(image_id, size)))
+        os.makedirs(image_dir(image_id), exist_ok=True)
+        for source, target in targets:
+            if not os.path.exists(target):
+                try:
+                    os.link(source, target)
+                except OSError:
+                    shutil.copy2(source, target)
+            moves.append(source)
+
+    if not renames:
+        return
+    # Сырой UPDATE мимо ORM: updated_at выставляем сами, иначе выгрузка с since не увидит новые image_id
+    now = utc_now()
+    with engine.begin() as connection:
+        connection.execute(
+            text("UPDATE items SET image_id = :image_id, updated_at = :now WHERE image_id = :legacy_id"),
+            [{"image_id": image_id, "legacy_id": legacy_id, "now": now} for legacy_id, image_id in renames.items()]
+        )
+    for path in moves:
+        os.remove(path)
+    logger.info(f"Migrated {len(renames)} legacy images to the content-addressed store")
+
+def iter_import_rows(upload: UploadFile, file_format: str):
+    """Построчно читает загруженный CSV или JSONL, не загружая файл в память целиком.
+
+    Отдаёт пары (номер строки, dict) или (номер строки, исключение разбора).
+    """
+    stream = io.TextIOWrapper(upload.file, encoding="utf-8-sig", newline="")
+    try:
+        if file_format == "jsonl":
+            for number, line in enumerate(stream, start=1):
+                if not line.strip():
+                    continue
+                try:
+                    yield number, json.loads(line)
+                except ValueError as e:
+                    yield number, e
+        else:
+            # Excel в русской локали сохраняет CSV через точку с запятой
+            header = stream.readline()
+            delimiter = ";" if header.count(";") > header.count(",") else ","
+            reader = csv.DictReader(io.StringIO(header), delimiter=delimiter)
+            fieldnames = [name.strip() for name in reader.fieldnames or []]
+            reader = csv.DictReader(stream, fieldnames=fieldnames, delimiter=delimiter)
+            for row in reader:
+                yield reader.line_num + 1, {
+                    key: value.strip() for key, value in row.items()
+                    if key and isinstance(value, str) and value.strip()
+                }
+    finally:
+        stream.detach()
+
+def format_validation_error(error: Exception) -> str:
+    if isinstance(error, ValidationError):
+        return "; ".join(
+            f"{'.'.join(str(part) for part in err['loc'])}: {err['msg']}" for err in error.errors()
+        )
+    return str(error)
+
+_file_hashes = {}
+_file_hashes_lock = threading.Lock()
+
+def file_etag(path: str) -> str:
+    """ETag по SHA-256 содержимого; хеш запоминается, пока не изменились mtime и размер файла."""
+    stat = os.stat(path)
+    signature = (stat.st_mtime_ns, stat.st_size)
+    with _file_hashes_lock:
+        cached = _file_hashes.get(path)
+    if cached and cached[0] == signature:
+        return cached[1]
+
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    etag = f'"{digest.hexdigest()}"'
+    with _file_hashes_lock:
+        _file_hashes[path] = (signature, etag)
+    return etag
+
+def encode_cursor(key) -> str:
+    return base64.urlsafe_b64encode(json.dumps(list(key)).encode()).decode()
+
+def decode_cursor(cursor: str, size: int) -> list:
+    try:
+        key = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if not isinstance(key, list) or len(key) != size:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    # Значения идут в сравнение с колонками: вложенные списки и объекты SQLite не привяжет (500),
+    # а bool в JSON — отдельный тип, ключом сортировки он быть не может
+    if any(isinstance(value, bool) or not isinstance(value, (int, float, str, type(None))) for value in key):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return key
+
+def select_items():
+    """SELECT только нужных колонок товара, без ORM-объектов."""
+    return select(*ITEM_COLUMNS)
+
+def paginate_items(db: Session, query, sort_columns, limit: int, after: Optional[str], params=None) -> dict:
+    """Keyset-пагинация: WHERE (name, id) > cursor ORDER BY name, id LIMIT n+1.
+
+    query - Core select из select_items(); строки сразу превращаются в dict для ответа.
+    """
+    if after:
+        query = query.where(tuple_(*sort_columns) > tuple(decode_cursor(after, len(sort_columns))))
+
+    # Ключи сортировки добавляются отдельными колонками с метками, чтобы не схлопнуться с колонками товара
+    key_size = len(sort_columns)
+    query = query.add_columns(*(column.label(f"sort_key_{i}") for i, column in enumerate(sort_columns)))
+    rows = db.execute(query.order_by(*sort_columns).limit(limit + 1), params or {}).all()
+    next_cursor = encode_cursor(rows[limit - 1][-key_size:]) if len(rows) > limit else None
+    items = [dict(zip(ITEM_FIELDS, row[:-key_size])) for row in rows[:limit]]
+    return {"items": items, "next_cursor": next_cursor}
+
+def stem_russian(word: str) -> str:
+    """Простейший стеммер: отрезает типичное окончание, оставляя основу от 3 букв."""
+    for ending in RUSSIAN_ENDINGS:
+        if word.endswith(ending) and len(word) - len(ending) >= 3:
+            return word[:-len(ending)]
+    return word
+
+def build_fts_query(text: str, prefix: bool = True, stem: bool = True) -> str:
+    """Превращает пользовательский ввод в безопасный MATCH-запрос FTS5.
+
+    items_fts хранит слова без стемминга, поэтому основа слова ищется только как префикс:
+    без prefix запрос ищет слово целиком, как введено.
+    """
+    terms = []
+    for token in re.findall(r"\w+", text.casefold()):
+        if stem and prefix:
+            token = stem_russian(token)
+        terms.append(f'"{token}"*' if prefix else f'"{token}"')
+    return " ".join(terms)
+
+def parse_parameter_value(value: Optional[str]) -> Optional[float]:
+    match = PARAMETER_NUMBER_RE.match(value or "")
+    return float(match.group(1).replace(",", ".")) if match else None
 
 def get_password_hash(password: str) -> str:
     return hashlib.sha256(password.encode()).hexdigest()
@@ -154,6 +1387,30 @@ def get_password_hash(password: str) -> str:
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     return get_password_hash(plain_password) == hashed_password
 
+class QueryCounter:
+    """Считает SQL-запросы, выполненные через engine, пока открыт контекст.
+
+    with QueryCounter(engine) as counter:
+        ...
+    counter.count
+    """
+
+    def __init__(self, bind):
+        self.bind = bind
+        self.count = 0
+        self.statements = []
+
+    def _on_execute(self, conn, cursor, statement, parameters, context, executemany):
+        self.count += 1
+        self.statements.append(statement)
+
+    def __enter__(self):
+        event.listen(self.bind, "before_cursor_execute", self._on_execute)
+        return self
+
+    def __exit__(self, *exc_info):
+        event.remove(self.bind, "before_cursor_execute", self._on_execute)
+
 # Database dependencies
 def get_db():
     db = SessionLocal()
@@ -162,6 +1419,182 @@ def get_db():
     finally:
         db.close()
 
+class Database:
+    """Доступ к базе для async-эндпоинтов.
+
+    run(fn, *args) вызывает обычный sync-код запросов fn(db, *args) в пуле потоков вне цикла
+    событий. Одновременно выполняется не больше DB_CONCURRENCY вызовов, остальные ждут,
+    не занимая потоков; медленная проверка пароля или тяжёлый запрос не останавливают
+    остальных клиентов.
+    """
+
+    def __init__(self, session_factory, concurrency: int = DB_CONCURRENCY):
+        self.session_factory = session_factory
+        self.limiter = anyio.CapacityLimiter(concurrency)
+
+    async def run(self, fn, *args):
+        return await anyio.to_thread.run_sync(self._call, fn, args, limiter=self.limiter)
+
+    def _call(self, fn, args):
+        with self.session_factory() as db:
+            return fn(db, *args)
+
+    def stats(self) -> dict:
+        return {
+            "limit": int(self.limiter.total_tokens),
+            "running": self.limiter.borrowed_tokens,
+            "waiting": self.limiter.statistics().tasks_waiting,
+        }
+
+database = Database(SessionLocal)
+
+def get_database() -> Database:
+    return database
+
+class WriteQueue:
+    """Единственный писатель: изменения из всех запросов выполняются по очереди в одном потоке.
+
+    Операции, накопившиеся за batch_window, выполняются одной транзакцией (group commit:
+    один fsync на пачку), каждая в своём SAVEPOINT — ошибка одной операции откатывает
+    только её и достаётся только её запросу. Очередь ограничена: когда она полна,
+    submit сразу отвечает 503 с Retry-After, и клиент повторяет запрос позже.
+
+    Большие операции (импорт, применение журнала репликации) идут через submit_exclusive:
+    писатель выполняет их в порядке очереди, одну, в собственной транзакции — остальные
+    записи ждут в очереди, а не упираются в блокировку базы.
+    """
+
+    def __init__(self, session_factory, max_size: int = WRITE_QUEUE_SIZE,
+                 batch_size: int = WRITE_BATCH_SIZE, batch_window: float = WRITE_BATCH_WINDOW):
+        self.session_factory = session_factory
+        self.batch_size = batch_size
+        self.batch_window = batch_window
+        self._queue = queue.Queue(max_size)
+        self._lock = threading.Lock()
+        self._thread = None
+        # Эксклюзивная операция, встреченная при сборе пачки: выполняется следующей
+        self._held = None
+        self.batches = 0
+        self.operations = 0
+        self.failed = 0
+        self.rejected = 0
+
+    async def submit(self, fn, *args):
+        """Выполняет fn(db, *args) в потоке писателя и возвращает результат после commit.
+
+        fn не вызывает commit сам и возвращает простые данные, а не объекты сессии:
+        после commit сессия писателя закрывается.
+        """
+        return await self._put(fn, args, False)
+
+    async def submit_exclusive(self, fn, *args):
+        """Выполняет fn(db, *args) в потоке писателя отдельно от пачек; commit/rollback делает сама fn."""
+        return await self._put(fn, args, True)
+
+    async def _put(self, fn, args, exclusive: bool):
+        future = Future()
+        try:
+            self._queue.put_nowait((fn, args, future, exclusive))
+        except queue.Full:
+            self.rejected += 1
+            raise HTTPException(status_code=503, detail="Write queue is full", headers={"Retry-After": "1"})
+        self._ensure_thread()
+        return await asyncio.wrap_future(future)
+
+    def _ensure_thread(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="db-writer", daemon=True)
+                self._thread.start()
+
+    def _next(self, timeout=None):
+        if self._held is not None:
+            operation, self._held = self._held, None
+            return operation
+        return self._queue.get(timeout=timeout)
+
+    def _run(self):
+        while True:
+            batch = [self._next()]
+            deadline = time.monotonic() + self.batch_window
+            while not batch[0][3] and len(batch) < self.batch_size:
+                try:
+                    operation = self._next(timeout=max(deadline - time.monotonic(), 0))
+                except queue.Empty:
+                    break
+                if operation[3]:
+                    self._held = operation
+                    break
+                batch.append(operation)
+            try:
+                if batch[0][3]:
+                    self._execute_exclusive(*batch[0][:3])
+                else:
+                    self._execute(batch)
+            except Exception as e:
+                logger.error(f"Write batch failed: {e}")
+                if isinstance(e, OperationalError) and "locked" in str(e):
+                    # Базу держит другой процесс (например, replicate.py): клиенту стоит повторить позже
+                    e = HTTPException(status_code=503, detail="Database is busy", headers={"Retry-After": "1"})
+                for _, _, future, _ in batch:
+                    if not future.done():
+                        future.set_exception(e)
+
+    def _execute_exclusive(self, fn, args, future):
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            with self.session_factory() as db:
+                result = fn(db, *args)
+        except Exception as e:
+            self.failed += 1
+            future.set_exception(e)
+        else:
+            future.set_result(result)
+        self.batches += 1
+        self.operations += 1
+
+    def _execute(self, batch):
+        results = []
+        with self.session_factory() as db:
+            # Без явного BEGIN первый SAVEPOINT сам открыл бы транзакцию и его RELEASE был бы commit
+            db.execute(text("BEGIN IMMEDIATE"))
+            for fn, args, future, _ in batch:
+                if not future.set_running_or_notify_cancel():
+                    continue
+                savepoint = db.begin_nested()
+                try:
+                    result = fn(db, *args)
+                    savepoint.commit()
+                    results.append((future, result, None))
+                except Exception as e:
+                    savepoint.rollback()
+                    results.append((future, None, e))
+            db.commit()
+
+        self.batches += 1
+        self.operations += len(results)
+        for future, result, error in results:
+            if error is not None:
+                self.failed += 1
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+    def stats(self) -> dict:
+        return {
+            "queued": self._queue.qsize(),
+            "batches": self.batches,
+            "operations": self.operations,
+            "failed": self.failed,
+            "rejected": self.rejected,
+        }
+
+write_queue = WriteQueue(SessionLocal)
+
+def get_write_queue() -> WriteQueue:
+    return write_queue
+
 # Service functions
 def get_user_by_username(db: Session, username: str) -> User:
     return db.query(User).filter(User.username == username).first()
@@ -175,43 +1608,442 @@ def get_category_by_id(db: Session, category_id: int) -> Category:
 def get_item_by_id(db: Session, item_id: int) -> Item:
     return db.query(Item).filter(Item.id == item_id).first()
 
+def get_item_facets(db: Session, category_id: Optional[int]) -> dict:
+    """Фасеты по категории: границы и распределение числовых значений, единицы измерения.
+
+    Если разных числовых значений не больше MAX_FACET_VALUES, values — точные счётчики по значениям,
+    иначе — счётчики по диапазонам (с upper), так что сумма count всегда равна числу товаров со значением.
+    """
+    base = db.query(Item)
+    if category_id:
+        base = base.filter(Item.category_id == category_id)
+
+    low, high, distinct = base.with_entities(
+        func.min(Item.parameter_numeric), func.max(Item.parameter_numeric), func.count(Item.parameter_numeric.distinct())
+    ).one()
+    numeric = base.filter(Item.parameter_numeric.isnot(None))
+    if distinct <= MAX_FACET_VALUES:
+        values = [
+            {"value": value, "count": count}
+            for value, count in numeric.with_entities(Item.parameter_numeric, func.count())
+            .group_by(Item.parameter_numeric).order_by(Item.parameter_numeric)
+        ]
+    else:
+        # Разных значений слишком много: MAX_FACET_VALUES диапазонов равной ширины от min до max,
+        # максимум попадает в последний диапазон
+        width = (high - low) / MAX_FACET_VALUES
+        bucket = func.min(
+            func.cast((Item.parameter_numeric - low) / width, Integer), MAX_FACET_VALUES - 1
+        ).label("bucket")
+        values = []
+        for index, count in numeric.with_entities(bucket, func.count()).group_by(bucket).order_by(bucket):
+            upper = high if index == MAX_FACET_VALUES - 1 else low + (index + 1) * width
+            values.append({"value": low + index * width, "upper": upper, "count": count})
+    units = base.with_entities(Item.unit, func.count()).group_by(Item.unit).order_by(Item.unit).all()
+    return {
+        "min": low,
+        "max": high,
+        "values": values,
+        "units": [{"value": unit, "count": count} for unit, count in units],
+    }
+
+def import_items(db: Session, rows, create_categories: bool) -> dict:
+    """Вставляет товары пачками по IMPORT_CHUNK_SIZE в текущей транзакции (без commit)."""
+    categories = {}
+    for category in db.query(Category.id, Category.name, Category.unit):
+        categories[category.name.casefold()] = (category.id, category.unit)
+    units_by_id = {category_id: unit for category_id, unit in categories.values()}
+
+    report = {
+        "inserted": 0, "created_categories": [], "error_count": 0, "errors": [],
+        "new_items": [], "category_ids": set()
+    }
+    chunk = []
+
+    def flush():
+        if chunk:
+            result = db.execute(insert(Item).returning(Item.id, Item.name), chunk)
+            report["category_ids"].update(row["category_id"] for row in chunk)
+            report["new_items"].extend(result.all())
+            report["inserted"] += len(chunk)
+            chunk.clear()
+
+    for number, raw in rows:
+        try:
+            if isinstance(raw, Exception):
+                raise raw
+            row = ItemImportRow.model_validate(raw)
+            if row.category_id is not None:
+                if row.category_id not in units_by_id:
+                    raise ValueError(f"Category {row.category_id} does not exist")
+                category_id = row.category_id
+            elif row.category:
+                key = row.category.strip().casefold()
+                if key not in categories:
+                    if not create_categories:
+                        raise ValueError(f"Category '{row.category}' does not exist")
+                    if not row.unit:
+                        raise ValueError(f"Unit is required to create category '{row.category}'")
+                    new_category = Category(name=row.category.strip(), unit=row.unit)
+                    db.add(new_category)
+                    db.flush()
+                    categories[key] = (new_category.id, new_category.unit)
+                    units_by_id[new_category.id] = new_category.unit
+                    report["created_categories"].append(new_category.name)
+                category_id = categories[key][0]
+            else:
+                raise ValueError("Either category or category_id is required")
+        except (ValueError, TypeError) as e:
+            report["error_count"] += 1
+            if len(report["errors"]) < MAX_IMPORT_ERRORS:
+                report["errors"].append({"row": number, "error": format_validation_error(e)})
+            continue
+
+        chunk.append({
+            "name": row.name,
+            "category_id": category_id,
+            "parameter_value": row.parameter_value,
+            "parameter_numeric": parse_parameter_value(row.parameter_value),
+            "unit": row.unit or units_by_id[category_id],
+            "image_id": row.image_id,
+        })
+        if len(chunk) >= IMPORT_CHUNK_SIZE:
+            flush()
+    flush()
+    return report
+
+def apply_item_batch(db: Session, batch: ItemBatch) -> dict:
+    """Применяет пакет изменений набором set-based запросов в текущей транзакции (без commit)."""
+    update_ids = [change.id for change in batch.update]
+    delete_ids = set(batch.delete)
+    if len(set(update_ids)) != len(update_ids):
+        raise HTTPException(status_code=400, detail="Duplicate item id in update")
+    if delete_ids & set(update_ids):
+        raise HTTPException(status_code=400, detail="Item is both updated and deleted")
+
+    category_ids = {item.category_id for item in batch.create}
+    category_ids |= {change.category_id for change in batch.update if change.category_id is not None}
+    if category_ids:
+        found = {row.id for row in db.query(Category.id).filter(Category.id.in_(category_ids))}
+        if category_ids - found:
+            raise HTTPException(status_code=400, detail=f"Category does not exist: {sorted(category_ids - found)}")
+
+    touched_ids = set(update_ids) | delete_ids
+    if touched_ids:
+        found = {row.id: row for row in db.query(Item.id, Item.category_id, Item.image_id).filter(Item.id.in_(touched_ids))}
+        if touched_ids - found.keys():
+            raise HTTPException(status_code=404, detail=f"Item not found: {sorted(touched_ids - found.keys())}")
+        # Старые категории изменённых и удалённых товаров тоже затронуты
+        category_ids |= {row.category_id for row in found.values()}
+        # Старые картинки могли остаться без ссылок
+        image_ids = {row.image_id for row in found.values() if row.image_id}
+    else:
+        image_ids = set()
+
+    if delete_ids:
+        db.execute(delete(Item).where(Item.id.in_(delete_ids)))
+
+    if batch.update:
+        rows = []
+        for change in batch.update:
+            values = change.model_dump(exclude_unset=True)
+            # Сбросить в null можно только image_id
+            if any(values[key] is None for key in values if key != "image_id"):
+                raise HTTPException(status_code=400, detail=f"Item {change.id}: only image_id can be null")
+            if "parameter_value" in values:
+                values["parameter_numeric"] = parse_parameter_value(values["parameter_value"])
+            rows.append(values)
+        # ORM bulk UPDATE по первичному ключу: один executemany на каждый набор колонок
+        db.execute(update(Item), rows)
+
+    created_ids = []
+    if batch.create:
+        rows = [
+            dict(item.model_dump(), parameter_numeric=parse_parameter_value(item.parameter_value))
+            for item in batch.create
+        ]
+        created_ids = list(db.execute(insert(Item).returning(Item.id), rows).scalars())
+
+    result_ids = created_ids + update_ids
+    rows = {item.id: item for item in db.query(Item).filter(Item.id.in_(result_ids))} if result_ids else {}
+    return {
+        "created": [rows[item_id] for item_id in created_ids],
+        "updated": [rows[item_id] for item_id in update_ids],
+        "deleted": sorted(delete_ids),
+        "category_ids": category_ids,
+        "image_ids": image_ids,
+    }
+
+def get_sync_changes(db: Session, since: int, limit: int) -> dict:
+    """Изменения с ревизией больше since: не больше limit строк и удалений в порядке ревизий.
+
+    Верхняя граница берётся из sync_revision до чтения таблиц: строка, изменённая во время
+    запроса, получит ревизию выше границы и придёт в следующий раз. Клиент применяет
+    сначала deletes, потом upserts — живая строка всегда новее удалений с тем же id.
+    """
+    database_id, upto = db.execute(
+        select(SyncRevision.database_id, SyncRevision.value).where(SyncRevision.id == 1)
+    ).one()
+    changes = []
+    for entity, columns in SYNC_COLUMNS.items():
+        revision = columns[-1]
+        query = select(*columns).where(revision > since, revision <= upto).order_by(revision).limit(limit + 1)
+        changes += [(row["revision"], entity, dict(row)) for row in db.execute(query).mappings()]
+    query = select(Tombstone.entity, Tombstone.entity_id, Tombstone.revision) \
+        .where(Tombstone.revision > since, Tombstone.revision <= upto).order_by(Tombstone.revision).limit(limit + 1)
+    changes += [(row.revision, row.entity, row.entity_id) for row in db.execute(query)]
+
+    changes.sort(key=lambda change: change[0])
+    more = len(changes) > limit
+    changes = changes[:limit]
+    upserts, deletes = {}, {}
+    for _, entity, change in changes:
+        if isinstance(change, dict):
+            upserts.setdefault(entity, []).append(change)
+        else:
+            deletes.setdefault(entity, []).append(change)
+    return {
+        "database": database_id,
+        "revision": changes[-1][0] if more else max(upto, since),
+        "more": more,
+        "upserts": upserts,
+        "deletes": deletes,
+    }
+
+# Replication
+def read_changelog(connection, since: int, limit: int = CHANGELOG_BATCH_SIZE) -> list:
+    rows = connection.execute(
+        select(ChangelogEntry.seq, ChangelogEntry.entity, ChangelogEntry.uid, ChangelogEntry.op,
+               ChangelogEntry.data, ChangelogEntry.version, ChangelogEntry.origin)
+        .where(ChangelogEntry.seq > since).order_by(ChangelogEntry.seq).limit(limit)
+    ).mappings()
+    return [dict(row, data=json.loads(row["data"]) if row["data"] else None) for row in rows]
+
+def encode_changelog_batch(source: str, entries: list) -> bytes:
+    """Файл пачки: gzip JSONL, первая строка — заголовок {"source", "from_seq", "to_seq"}."""
+    header = {
+        "source": source,
+        "from_seq": entries[0]["seq"] if entries else None,
+        "to_seq": entries[-1]["seq"] if entries else None,
+    }
+    lines = [json.dumps(header)] + [json.dumps(entry, ensure_ascii=False) for entry in entries]
+    return gzip.compress("\n".join(lines).encode())
+
+def decode_changelog_batch(content: bytes):
+    lines = gzip.decompress(content).decode().splitlines()
+    return json.loads(lines[0]), [json.loads(line) for line in lines[1:] if line]
+
+def current_version(connection, entity: str, uid: str) -> Optional[tuple]:
+    row = connection.execute(
+        select(ChangelogEntry.version, ChangelogEntry.origin)
+        .where(ChangelogEntry.entity == entity, ChangelogEntry.uid == uid)
+        .order_by(ChangelogEntry.seq.desc()).limit(1)
+    ).first()
+    return tuple(row) if row else None
+
+def resolve_uid(connection, entity: str, uid: Optional[str]) -> Optional[str]:
+    if not uid:
+        return uid
+    target = connection.execute(
+        select(ReplicationAlias.target_uid).where(ReplicationAlias.entity == entity, ReplicationAlias.uid == uid)
+    ).scalar()
+    return target or uid
+
+def add_alias(connection, entity: str, uid: str, target_uid: str):
+    # Старые псевдонимы, указывавшие на uid, тоже переводим на target_uid: цепочек не бывает
+    connection.execute(
+        update(ReplicationAlias)
+        .where(ReplicationAlias.entity == entity, ReplicationAlias.target_uid == uid)
+        .values(target_uid=target_uid)
+    )
+    connection.execute(text(
+        "INSERT INTO replication_aliases (entity, uid, target_uid) VALUES (:entity, :uid, :target_uid) "
+        "ON CONFLICT (entity, uid) DO UPDATE SET target_uid = excluded.target_uid"
+    ), {"entity": entity, "uid": uid, "target_uid": target_uid})
+
+def apply_changelog_entry(connection, entry: dict) -> Optional[str]:
+    """Применяет одно изменение; возвращает причину, если применить нельзя."""
+    model = REPLICATION_MODELS[entry["entity"]]
+    if entry["op"] == "delete":
+        if model is Category:
+            # Как cascade в модели: товары удаляются вместе с категорией
+            category_id = select(Category.id).where(Category.uid == entry["uid"]).scalar_subquery()
+            connection.execute(delete(Item).where(Item.category_id == category_id))
+        deleted = connection.execute(delete(model).where(model.uid == entry["uid"])).rowcount
+        if not deleted:
+            # Строки здесь нет, но версию удаления запоминаем: старое изменение её не воскресит
+            connection.execute(insert(ChangelogEntry).values(
+                entity=entry["entity"], uid=entry["uid"], op="delete",
+                version=entry["version"], origin=entry["origin"]
+            ))
+        return None
+
+    values = {}
+    for field in REPLICATION_FIELDS[entry["entity"]]:
+        if isinstance(field, tuple):
+            column, target = field
+            ref_uid = resolve_uid(connection, target, entry["data"].get(f"{column[:-3]}_uid"))
+            ref_model = REPLICATION_MODELS[target]
+            ref_id = connection.execute(select(ref_model.id).where(ref_model.uid == ref_uid)).scalar() if ref_uid else None
+            if ref_uid and ref_id is None:
+                return f"{target} {ref_uid} not found"
+            values[column] = ref_id
+        else:
+            values[field] = entry["data"].get(field)
+
+    uid = entry["uid"]
+    row_id = connection.execute(select(model.id).where(model.uid == uid)).scalar()
+    natural_key = REPLICATION_NATURAL_KEYS.get(entry["entity"])
+    if row_id is None and natural_key:
+        key_column = getattr(model, natural_key)
+        row = connection.execute(select(model.id, model.uid).where(key_column == values[natural_key])).first()
+        if row is not None:
+            # Одна и та же строка, созданная в двух базах: обе оставляют меньший uid,
+            # больший запоминается как псевдоним для следующих изменений и ссылок
+            row_id, uid = row.id, min(row.uid, uid)
+            add_alias(connection, entry["entity"], max(row.uid, entry["uid"]), uid)
+            if uid != row.uid:
+                connection.execute(update(model).where(model.id == row_id).values(uid=uid))
+    if row_id is None:
+        connection.execute(insert(model).values(uid=uid, **values))
+    else:
+        connection.execute(update(model).where(model.id == row_id).values(**values))
+    return None
+
+def apply_changelog(connection, source: str, entries: list) -> dict:
+    """Применяет пачку журнала другой базы в текущей транзакции (без commit).
+
+    Повторное применение безопасно: записи до last_seq источника, свои собственные
+    изменения и изменения не новее уже известных пропускаются.
+    """
+    own_id = connection.execute(select(SyncRevision.database_id).where(SyncRevision.id == 1)).scalar()
+    last_seq = connection.execute(
+        select(ReplicationPeer.last_seq).where(ReplicationPeer.source == source)
+    ).scalar() or 0
+    report = {"source": source, "applied": 0, "skipped": 0, "conflicts": []}
+
+    for entry in entries:
+        if entry["seq"] <= last_seq:
+            report["skipped"] += 1
+            continue
+        last_seq = entry["seq"]
+        if entry["origin"] == own_id or entry["entity"] not in REPLICATION_MODELS:
+            report["skipped"] += 1
+            continue
+        entry = dict(entry, uid=resolve_uid(connection, entry["entity"], entry["uid"]))
+        known = current_version(connection, entry["entity"], entry["uid"])
+        if known and (entry["version"], entry["origin"]) <= known:
+            report["skipped"] += 1
+            continue
+
+        # Часы Лэмпорта: следующие локальные изменения будут новее применённого
+        connection.execute(
+            update(SyncRevision).where(SyncRevision.id == 1)
+            .values(value=func.max(SyncRevision.value, entry["version"]))
+        )
+        connection.execute(insert(ReplicationApply).values(origin=entry["origin"], version=entry["version"]))
+        try:
+            reason = apply_changelog_entry(connection, entry)
+        finally:
+            connection.execute(delete(ReplicationApply))
+        if reason:
+            report["conflicts"].append({"seq": entry["seq"], "entity": entry["entity"], "uid": entry["uid"], "reason": reason})
+        else:
+            report["applied"] += 1
+
+    connection.execute(text(
+        "INSERT INTO replication_peers (source, last_seq) VALUES (:source, :last_seq) "
+        "ON CONFLICT (source) DO UPDATE SET last_seq = max(last_seq, excluded.last_seq)"
+    ), {"source": source, "last_seq": last_seq})
+    report["last_seq"] = last_seq
+    return report
+
+def build_suggest_index(db: Session):
+    entries = [("category", row.id, row.name) for row in db.query(Category.id, Category.name)]
+    entries += [("item", row.id, row.name) for row in db.query(Item.id, Item.name)]
+    suggest_index.build(entries)
+    logger.info(f"Suggest index built: {len(entries)} names")
+
+def item_event_data(item: Item) -> dict:
+    return ItemResponse.model_validate(item).model_dump(mode="json")
+
+def category_event_data(category: Category) -> dict:
+    return CategoryResponse.model_validate(category).model_dump(mode="json")
+
+async def submit_once(write_queue: WriteQueue, key: Optional[str], fn) -> tuple:
+    """Выполняет fn через писателя не больше одного раза на ключ Idempotency-Key.
+
+    Возвращает (результат, повтор ли это). Ключ записывается в той же транзакции, что и изменение;
+    для повтора возвращается сохранённый результат, а события и кэши вызывающий уже не трогает.
+    """
+    if not key:
+        return await write_queue.submit(fn), False
+
+    def run(db: Session):
+        applied = db.get(AppliedOperation, key)
+        if applied is not None:
+            return json.loads(applied.result), True
+        result = fn(db)
+        cutoff = utc_now() - timedelta(seconds=IDEMPOTENCY_TTL_SECONDS)
+        db.execute(delete(AppliedOperation).where(AppliedOperation.created_at < cutoff))
+        db.add(AppliedOperation(key=key, result=json.dumps(result, ensure_ascii=False)))
+        return result, False
+
+    return await write_queue.submit(run)
+
 # API endpoints
 @app.post("/register", response_model=UserResponse)
-def register(user: UserRegister, db: Session = Depends(get_db)):
-    if get_user_by_username(db, user.username):
-        raise HTTPException(status_code=400, detail="Username already registered")
-    
-    role = get_role_by_id(db, user.role_id)
-    if not role:
-        raise HTTPException(status_code=400, detail="Role does not exist")
-    
-    # Используем passlib для хеширования пароля
-    hashed_password = pwd_context.hash(user.password)
-    
-    new_user = User(
-        username=user.username,
-        password=hashed_password,
-        full_name=user.full_name,
-        role_id=user.role_id
-    )
-    
-    db.add(new_user)
-    db.commit()
-    db.refresh(new_user)
+async def register(
+    user: UserRegister,
+    database: Database = Depends(get_database),
+    write_queue: WriteQueue = Depends(get_write_queue)
+):
+    def get_role_name(db: Session):
+        if get_user_by_username(db, user.username):
+            raise HTTPException(status_code=400, detail="Username already registered")
+
+        role = get_role_by_id(db, user.role_id)
+        if not role:
+            raise HTTPException(status_code=400, detail="Role does not exist")
+        return role.name
+
+    role_name = await database.run(get_role_name)
+
+    # Используем passlib для хеширования пароля; bcrypt медленный, поэтому в пуле потоков и без лимита базы
+    hashed_password = await run_in_threadpool(pwd_context.hash, user.password)
+
+    def create_user(db: Session):
+        # Писатель один, поэтому повторная проверка здесь исключает гонку двух регистраций
+        if get_user_by_username(db, user.username):
+            raise HTTPException(status_code=400, detail="Username already registered")
+        new_user = User(
+            username=user.username,
+            password=hashed_password,
+            full_name=user.full_name,
+            role_id=user.role_id
+        )
+        db.add(new_user)
+        db.flush()
+        return new_user.id
+
+    user_id = await write_queue.submit(create_user)
+    response_cache.invalidate("users")
     
     # Возвращаем пользователя с ролью
-    return {
-        "id": new_user.id,
-        "username": new_user.username,
-        "full_name": new_user.full_name,
-        "role": role.name  # Добавляем имя роли в ответ
+    result = {
+        "id": user_id,
+        "username": user.username,
+        "full_name": user.full_name,
+        "role": role_name  # Добавляем имя роли в ответ
     }
+    change_feed.publish("users", "create", user_id, result)
+    return result
 
 @app.post("/login")
-def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
-    user = get_user_by_username(db, form_data.username)
+async def login(form_data: OAuth2PasswordRequestForm = Depends(), database: Database = Depends(get_database)):
+    user = await database.run(get_user_by_username, form_data.username)
     
-    if not user or not pwd_context.verify(form_data.password, user.password):
+    if not user or not await run_in_threadpool(pwd_context.verify, form_data.password, user.password):
         raise HTTPException(status_code=401, detail="Invalid credentials")
     
     if user.username == "admin" and not os.path.exists(CONFIG_PATH):
@@ -222,127 +2054,833 @@ def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depend
 
 # Role endpoints
 @app.post("/roles", response_model=RoleResponse)
-def create_role(role: RoleCreate, db: Session = Depends(get_db)):
-    if db.query(Role).filter(Role.name == role.name).first():
-        raise HTTPException(status_code=400, detail="Role already exists")
-    
-    new_role = Role(name=role.name)
-    db.add(new_role)
-    db.commit()
-    db.refresh(new_role)
-    return new_role
+async def create_role(
+    role: RoleCreate,
+    idempotency_key: Optional[str] = Header(None),
+    write_queue: WriteQueue = Depends(get_write_queue)
+):
+    def create(db: Session):
+        if db.query(Role).filter(Role.name == role.name).first():
+            raise HTTPException(status_code=400, detail="Role already exists")
+
+        new_role = Role(name=role.name)
+        db.add(new_role)
+        db.flush()
+        return {"id": new_role.id, "name": new_role.name}
+
+    result, replayed = await submit_once(write_queue, idempotency_key, create)
+    if replayed:
+        return result
+    response_cache.invalidate("roles")
+    change_feed.publish("roles", "create", result["id"], result)
+    return result
 
 @app.get("/roles", response_model=List[RoleResponse])
-def get_roles(db: Session = Depends(get_db)):
-    return db.query(Role).all()
+async def get_roles(request: Request, database: Database = Depends(get_database)):
+    def build(db: Session):
+        rows = db.execute(select(Role.id, Role.name).order_by(Role.id)).mappings()
+        return [dict(row) for row in rows]
+    return await cached_db_response(request, ["roles"], database, build)
 
 @app.delete("/roles/{role_id}")
-def delete_role(role_id: int, db: Session = Depends(get_db)):
-    role = db.query(Role).get(role_id)
-    
-    if not role:
-        raise HTTPException(status_code=404, detail="Role not found")
-    
-    db.delete(role)
-    db.commit()
+async def delete_role(role_id: int, write_queue: WriteQueue = Depends(get_write_queue)):
+    def remove(db: Session):
+        role = db.query(Role).get(role_id)
+
+        if not role:
+            raise HTTPException(status_code=404, detail="Role not found")
+
+        db.delete(role)
+
+    await write_queue.submit(remove)
+    # Пользователи показывают название роли
+    response_cache.invalidate("roles", "users")
+    change_feed.publish("roles", "delete", role_id)
     return {"message": "Role deleted successfully"}
 
 # User endpoints
 @app.get("/users", response_model=List[UserResponse])
-def get_users(db: Session = Depends(get_db)):
-    users = db.query(User).all()
-    result = []
-    for user in users:
-        role = get_role_by_id(db, user.role_id)
-        result.append({
-            "id": user.id,
-            "username": user.username,
-            "full_name": user.full_name,
-            "role": role.name if role else None  # Добавляем имя роли в ответ
-        })
-    return result
+async def get_users(request: Request, database: Database = Depends(get_database)):
+    # Роли подтягиваются тем же запросом через JOIN, без отдельного SELECT на каждого пользователя
+    def build(db: Session):
+        query = select(User.id, User.username, User.full_name, Role.name.label("role")) \
+            .outerjoin(Role, Role.id == User.role_id).order_by(User.id)
+        return [dict(row) for row in db.execute(query).mappings()]
+    return await cached_db_response(request, ["users"], database, build)
 
 @app.delete("/users/{user_id}")
-def delete_user(user_id: int, db: Session = Depends(get_db)):
-    user = db.query(User).get(user_id)
-    
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
-    
-    db.delete(user)
-    db.commit()
+async def delete_user(user_id: int, write_queue: WriteQueue = Depends(get_write_queue)):
+    def remove(db: Session):
+        user = db.query(User).get(user_id)
+
+        if not user:
+            raise HTTPException(status_code=404, detail="User not found")
+
+        db.delete(user)
+
+    await write_queue.submit(remove)
+    response_cache.invalidate("users")
+    change_feed.publish("users", "delete", user_id)
     return {"message": "User deleted successfully"}
 
 # Category endpoints
 @app.post("/categories", response_model=CategoryResponse)
-def create_category(category: CategoryCreate, db: Session = Depends(get_db)):
-    new_category = Category(**category.model_dump())
-    db.add(new_category)
-    db.commit()
-    db.refresh(new_category)
-    return new_category
+async def create_category(
+    category: CategoryCreate,
+    idempotency_key: Optional[str] = Header(None),
+    write_queue: WriteQueue = Depends(get_write_queue)
+):
+    def create(db: Session):
+        # Без проверки уникальный индекс по имени дал бы IntegrityError (500), и клиент повторял бы запрос вечно
+        if db.query(Category.id).filter(Category.name == category.name).first():
+            raise HTTPException(status_code=400, detail="Category already exists")
+        new_category = Category(**category.model_dump())
+        db.add(new_category)
+        db.flush()
+        return category_event_data(new_category)
+
+    result, replayed = await submit_once(write_queue, idempotency_key, create)
+    if replayed:
+        return result
+    suggest_index.add("category", result["id"], result["name"])
+    response_cache.invalidate("categories")
+    change_feed.publish("categories", "create", result["id"], result)
+    return result
 
 @app.get("/categories", response_model=List[CategoryResponse])
-def get_categories(db: Session = Depends(get_db)):
-    return db.query(Category).all()
+async def get_categories(request: Request, database: Database = Depends(get_database)):
+    def build(db: Session):
+        query = select(Category.id, Category.name, Category.parameter, Category.unit).order_by(Category.id)
+        return [dict(row) for row in db.execute(query).mappings()]
+    return await cached_db_response(request, ["categories"], database, build)
 
 @app.delete("/categories/{category_id}")
-def delete_category(category_id: int, db: Session = Depends(get_db)):
-    category = db.query(Category).get(category_id)
-    
-    if not category:
-        raise HTTPException(status_code=404, detail="Category not found")
-    
-    db.delete(category)
-    db.commit()
+async def delete_category(
+    category_id: int,
+    database: Database = Depends(get_database),
+    write_queue: WriteQueue = Depends(get_write_queue)
+):
+    def remove(db: Session):
+        category = db.query(Category).get(category_id)
+
+        if not category:
+            raise HTTPException(status_code=404, detail="Category not found")
+
+        items = [(item.id, item.image_id) for item in category.items]
+        db.delete(category)
+        return items
+
+    items = await write_queue.submit(remove)
+    item_ids = [item_id for item_id, _ in items]
+    image_ids = [image_id for _, image_id in items]
+    suggest_index.remove("category", category_id)
+    for item_id in item_ids:
+        suggest_index.remove("item", item_id)
+    response_cache.invalidate("categories", *item_cache_tags([category_id]))
+    await database.run(release_images, image_ids)
+    # Товары категории удалены вместе с ней; клиенты убирают их по событию категории
+    change_feed.publish("categories", "delete", category_id)
     return {"message": "Category deleted successfully"}
 
 # Item endpoints
 @app.post("/items", response_model=ItemResponse)
-def create_item(item: ItemCreate, db: Session = Depends(get_db)):
-    new_item = Item(**item.model_dump())
-    db.add(new_item)
-    db.commit()
-    db.refresh(new_item)
-    return new_item
-
-@app.get("/items", response_model=List[ItemResponse])
-def get_items(category_id: Optional[int] = None, db: Session = Depends(get_db)):
-    query = db.query(Item)
-    return query.filter(Item.category_id == category_id).all() if category_id else query.all()
-
-@app.get("/items/search", response_model=List[ItemResponse])
-def search_items(query: str, db: Session = Depends(get_db)):
-    return db.query(Item).filter(Item.name.contains(query)).all()
+async def create_item(
+    item: ItemCreate,
+    idempotency_key: Optional[str] = Header(None),
+    write_queue: WriteQueue = Depends(get_write_queue)
+):
+    def create(db: Session):
+        new_item = Item(**item.model_dump(), parameter_numeric=parse_parameter_value(item.parameter_value))
+        db.add(new_item)
+        db.flush()
+        # updated_at и revision выставляют значения по умолчанию и триггеры
+        db.refresh(new_item)
+        return item_event_data(new_item)
+
+    result, replayed = await submit_once(write_queue, idempotency_key, create)
+    if replayed:
+        return result
+    suggest_index.add("item", result["id"], result["name"])
+    response_cache.invalidate(*item_cache_tags([result["category_id"]]))
+    change_feed.publish("items", "create", result["id"], result)
+    return result
+
+@app.post("/items/import", response_model=ImportReport)
+async def import_items_file(
+    file: UploadFile = File(...),
+    file_format: Optional[str] = Form(None, alias="format", pattern="^(csv|jsonl)$"),
+    create_categories: bool = Form(True),
+    all_or_nothing: bool = Form(False),
+    database: Database = Depends(get_database),
+    write_queue: WriteQueue = Depends(get_write_queue)
+):
+    """Массовый импорт товаров из CSV или JSONL одной транзакцией.
+
+    Колонки: name, category (название) или category_id, parameter_value, unit, image_id.
+    Импорт выполняет писатель (WriteQueue) отдельно от остальных записей, они ждут в очереди.
+    """
+    if not file_format:
+        file_format = "jsonl" if (file.filename or "").lower().endswith((".jsonl", ".ndjson")) else "csv"
+
+    def run_import(db: Session):
+        report = import_items(db, iter_import_rows(file, file_format), create_categories)
+        if all_or_nothing and report["error_count"]:
+            db.rollback()
+            report.update(inserted=0, created_categories=[], new_items=[])
+            return report
+        db.commit()
+        report["created_category_ids"] = [
+            (category.id, category.name)
+            for category in db.query(Category.id, Category.name).filter(Category.name.in_(report["created_categories"]))
+        ]
+        return report
+
+    report = await write_queue.submit_exclusive(run_import)
+    if all_or_nothing and report["error_count"]:
+        return report
+    response_cache.invalidate("categories", *item_cache_tags(report.pop("category_ids")))
+
+    new_items = report.pop("new_items")
+    created_category_ids = report.pop("created_category_ids")
+    if len(new_items) > SUGGEST_REBUILD_THRESHOLD:
+        await database.run(build_suggest_index)
+    else:
+        for category_id, name in created_category_ids:
+            suggest_index.add("category", category_id, name)
+        for item_id, name in new_items:
+            suggest_index.add("item", item_id, name)
+    logger.info(f"Imported {report['inserted']} items, {report['error_count']} rows rejected")
+    if report["created_categories"]:
+        change_feed.publish("categories", "reset")
+    if report["inserted"]:
+        change_feed.publish("items", "reset")
+    return report
+
+@app.post("/items/batch", response_model=ItemBatchResult)
+async def batch_items(
+    batch: ItemBatch,
+    database: Database = Depends(get_database),
+    write_queue: WriteQueue = Depends(get_write_queue)
+):
+    """Создание, изменение и удаление многих товаров одной транзакцией."""
+    def apply(db: Session):
+        result = apply_item_batch(db, batch)
+        for op in ("created", "updated"):
+            result[op] = [item_event_data(item) for item in result[op]]
+        return result
+
+    result = await write_queue.submit(apply)
+    response_cache.invalidate(*item_cache_tags(result.pop("category_ids")))
+    await database.run(release_images, result.pop("image_ids"))
+
+    for item_id in result["deleted"]:
+        suggest_index.remove("item", item_id)
+    for item in result["updated"]:
+        suggest_index.remove("item", item["id"])
+        suggest_index.add("item", item["id"], item["name"])
+    for item in result["created"]:
+        suggest_index.add("item", item["id"], item["name"])
+
+    for item_id in result["deleted"]:
+        change_feed.publish("items", "delete", item_id)
+    for op in ("update", "create"):
+        for item in result[f"{op}d"]:
+            change_feed.publish("items", op, item["id"], item)
+    return result
+
+@app.get("/items", response_model=ItemPage)
+async def get_items(
+    request: Request,
+    category_id: Optional[int] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    after: Optional[str] = None,
+    sort: str = Query("id", pattern="^(id|name)$"),
+    min_value: Optional[float] = Query(None, alias="min"),
+    max_value: Optional[float] = Query(None, alias="max"),
+    facets: bool = False,
+    database: Database = Depends(get_database)
+):
+    def build(db: Session):
+        query = select_items()
+        if category_id:
+            query = query.where(Item.category_id == category_id)
+        if min_value is not None:
+            query = query.where(Item.parameter_numeric >= min_value)
+        if max_value is not None:
+            query = query.where(Item.parameter_numeric <= max_value)
+        sort_columns = [getattr(Item, name) for name in ITEM_SORT_COLUMNS[sort]]
+        result = paginate_items(db, query, sort_columns, limit, after)
+        # Фасеты считаются только для первой страницы
+        if facets and not after:
+            result["facets"] = get_item_facets(db, category_id)
+        return result
+    return await cached_db_response(request, [f"items:{category_id}" if category_id else "items:all"], database, build)
+
+@app.get("/items/search", response_model=ItemPage)
+async def search_items(
+    request: Request,
+    query: str,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    after: Optional[str] = None,
+    sort: str = Query("rank", pattern="^(rank|id|name)$"),
+    prefix: bool = True,
+    stem: bool = True,
+    database: Database = Depends(get_database)
+):
+    match = build_fts_query(query, prefix=prefix, stem=stem)
+    if not match:
+        return api_response(request, {"items": [], "next_cursor": None})
+
+    # bm25-ранжирование через полнотекстовый индекс items_fts
+    fts = text("SELECT rowid AS id, rank FROM items_fts WHERE items_fts MATCH :match") \
+        .columns(id=Integer, rank=Float).subquery("fts")
+    items = select_items().join(fts, fts.c.id == Item.id)
+    if sort == "rank":
+        sort_columns = [fts.c.rank, Item.id]
+    else:
+        sort_columns = [getattr(Item, name) for name in ITEM_SORT_COLUMNS[sort]]
+    page = await database.run(paginate_items, items, sort_columns, limit, after, {"match": match})
+    return api_response(request, page)
+
+@app.get("/items/suggest", response_model=List[Suggestion])
+def suggest_items(
+    prefix: str,
+    limit: int = Query(DEFAULT_SUGGEST_LIMIT, ge=1, le=MAX_PAGE_SIZE),
+    db: Session = Depends(get_db)
+):
+    # Индекс строится при старте; здесь только подстраховка на случай запуска без __main__
+    if not suggest_index.built:
+        build_suggest_index(db)
+    return suggest_index.complete(prefix, limit)
 
 @app.delete("/items/{item_id}")
-def delete_item(item_id: int, db: Session = Depends(get_db)):
-    item = db.query(Item).get(item_id)
-    
-    if not item:
-        raise HTTPException(status_code=404, detail="Item not found")
-    
-    db.delete(item)
-    db.commit()
+async def delete_item(
+    item_id: int,
+    database: Database = Depends(get_database),
+    write_queue: WriteQueue = Depends(get_write_queue)
+):
+    def remove(db: Session):
+        item = db.query(Item).get(item_id)
+
+        if not item:
+            raise HTTPException(status_code=404, detail="Item not found")
+
+        db.delete(item)
+        return item.category_id, item.image_id
+
+    category_id, image_id = await write_queue.submit(remove)
+    suggest_index.remove("item", item_id)
+    response_cache.invalidate(*item_cache_tags([category_id]))
+    await database.run(release_images, [image_id])
+    change_feed.publish("items", "delete", item_id)
     return {"message": "Item deleted successfully"}
 
+@app.get("/events")
+async def stream_events(request: Request, last_event_id: Optional[str] = Header(None)):
+    """Server-Sent Events с изменениями каталога и учётных записей.
+
+    После переподключения клиент присылает Last-Event-ID и получает пропущенные события;
+    если их уже нет в истории (или сервер перезапускался), приходит событие reset.
+    """
+    since = None
+    if last_event_id:
+        boot_id, _, revision = last_event_id.rpartition("-")
+        since = int(revision) if boot_id == BOOT_ID and revision.isdigit() else -1
+    queue, missed = change_feed.subscribe(since)
+
+    async def stream():
+        try:
+            if missed is None:
+                yield format_event({"entity": None, "op": "reset", "id": None, "revision": change_feed.revision})
+            for event in missed or []:
+                yield format_event(event)
+            while not await request.is_disconnected():
+                try:
+                    event = await asyncio.wait_for(queue.get(), EVENTS_KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+                    continue
+                yield format_event(event)
+        finally:
+            change_feed.unsubscribe(queue)
+
+    return StreamingResponse(stream(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+@app.get("/sync", response_model=SyncChanges)
+async def sync_changes(
+    request: Request,
+    since: int = Query(0, ge=0),
+    limit: int = Query(SYNC_PAGE_SIZE, ge=1, le=MAX_SYNC_PAGE_SIZE),
+    database: Database = Depends(get_database)
+):
+    """Изменения ролей, пользователей, категорий и товаров после ревизии since.
+
+    Ответ: {"database", "revision", "more", "upserts": {таблица: [строки]}, "deletes": {таблица: [id]}}.
+    Следующий запрос — с since=revision; пока more=true, есть ещё изменения.
+    """
+    return api_response(request, await database.run(get_sync_changes, since, limit))
+
+@app.get("/replication/status")
+def replication_status(db: Session = Depends(get_db)):
+    """id этой базы, последний seq её журнала и докуда применены журналы других баз."""
+    return {
+        "database": db.execute(select(SyncRevision.database_id).where(SyncRevision.id == 1)).scalar(),
+        "last_seq": db.execute(select(func.max(ChangelogEntry.seq))).scalar() or 0,
+        "peers": dict(db.execute(select(ReplicationPeer.source, ReplicationPeer.last_seq)).all()),
+    }
+
+@app.get("/replication/changelog")
+def export_changelog(
+    since: int = Query(0, ge=0),
+    limit: int = Query(CHANGELOG_BATCH_SIZE, ge=1, le=CHANGELOG_BATCH_SIZE),
+    db: Session = Depends(get_db)
+):
+    """Пачка журнала после seq since для переноса в другой магазин (файлом или запросом)."""
+    source = db.execute(select(SyncRevision.database_id).where(SyncRevision.id == 1)).scalar()
+    entries = read_changelog(db.connection(), since, limit)
+    filename = f"changelog-{source[:8]}-{since}-{entries[-1]['seq'] if entries else since}.jsonl.gz"
+    return Response(
+        encode_changelog_batch(source, entries),
+        media_type="application/gzip",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
+@app.post("/replication/apply", response_model=ReplicationReport)
+async def apply_changelog_file(
+    file: UploadFile = File(...),
+    database: Database = Depends(get_database),
+    write_queue: WriteQueue = Depends(get_write_queue)
+):
+    """Применение пачки журнала другого магазина одной транзакцией (через писателя, как импорт)."""
+    try:
+        header, entries = await run_in_threadpool(decode_changelog_batch, await file.read())
+    except (OSError, ValueError, IndexError):
+        raise HTTPException(status_code=400, detail="Invalid changelog batch")
+
+    def apply(db: Session):
+        report = apply_changelog(db.connection(), header["source"], entries)
+        db.commit()
+        return report
+
+    report = await write_queue.submit_exclusive(apply)
+
+    if report["applied"]:
+        response_cache.clear()
+        await database.run(build_suggest_index)
+        for entity in REPLICATION_MODELS:
+            change_feed.publish(entity, "reset")
+    logger.info(f"Applied {report['applied']} changes from {header['source']}, {len(report['conflicts'])} conflicts")
+    return report
+
+@app.get("/storage/profile")
+def get_storage_profile(db: Session = Depends(get_db)):
+    """Профиль хранения из db.json и фактические значения прагм на соединении."""
+    actual = {name: db.execute(text(f"PRAGMA {name}")).scalar() for name in STORAGE_PRAGMAS}
+    return {"profile": STORAGE_PROFILE, "pragmas": actual}
+
+@app.get("/cache/stats")
+def get_cache_stats():
+    return dict(
+        response_cache.stats(),
+        coalesced=request_flights.coalesced,
+        in_flight=request_flights.in_flight(),
+        images=image_cache.stats(),
+        event_subscribers=change_feed.subscribers(),
+        database=database.stats(),
+        writes=write_queue.stats()
+    )
+
+# Export endpoints
+def iter_export_batches(category_id: Optional[int], since: Optional[datetime]):
+    """Отдаёт товары пачками по EXPORT_BATCH_SIZE через курсор, не держа всю таблицу в памяти."""
+    query = select(
+        Item.id, Item.name, Item.category_id, Category.name.label("category"),
+        Item.parameter_value, Item.unit, Item.image_id, Item.updated_at
+    ).outerjoin(Category, Category.id == Item.category_id).order_by(Item.id)
+    if category_id:
+        query = query.where(Item.category_id == category_id)
+    if since:
+        # updated_at хранится в наивном UTC: время со смещением сначала переводим в UTC
+        if since.tzinfo is not None:
+            since = since.astimezone(timezone.utc).replace(tzinfo=None)
+        query = query.where(Item.updated_at >= since)
+
+    # Своё соединение: сессия из get_db закрывается раньше, чем закончится отдача ответа
+    with engine.connect() as connection:
+        result = connection.execution_options(yield_per=EXPORT_BATCH_SIZE).execute(query)
+        for rows in result.partitions():
+            yield [
+                dict(row._mapping, updated_at=row.updated_at.isoformat() if row.updated_at else None)
+                for row in rows
+            ]
+
+def encode_ndjson(batches):
+    for rows in batches:
+        yield "".join(json.dumps(row, ensure_ascii=False) + "\n" for row in rows).encode()
+
+def encode_csv(batches):
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=EXPORT_COLUMNS)
+    # BOM, чтобы Excel открыл кириллицу правильно
+    buffer.write("\ufeff")
+    writer.writeheader()
+    for rows in batches:
+        writer.writerows(rows)
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode()
+
+def gzip_stream(chunks):
+    compressor = zlib.compressobj(wbits=31)  # 31 = формат gzip
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+@app.get("/export/items")
+def export_items(
+    file_format: str = Query("ndjson", alias="format", pattern="^(ndjson|csv)$"),
+    category_id: Optional[int] = None,
+    since: Optional[datetime] = None,
+    gzip: bool = False
+):
+    """Потоковая выгрузка каталога в NDJSON или CSV (опционально gzip) с постоянным расходом памяти."""
+    batches = iter_export_batches(category_id, since)
+    if file_format == "csv":
+        body, media_type, filename = encode_csv(batches), "text/csv; charset=utf-8", "items.csv"
+    else:
+        body, media_type, filename = encode_ndjson(batches), "application/x-ndjson", "items.ndjson"
+    if gzip:
+        body, media_type, filename = gzip_stream(body), "application/gzip", filename + ".gz"
+    return StreamingResponse(
+        body,
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
 # Image endpoints
 @app.post("/upload_image")
 def upload_image(image: UploadFile = File(...)):
-    return {"image_id": save_image(image)}
+    return save_image(image)
+
+@app.post("/upload_images", response_model=List[ImageUploadResult])
+async def upload_images(request: Request):
+    """Загрузка многих картинок одним multipart-запросом; ошибка в одном файле не отменяет остальные.
+
+    Форма разбирается здесь, а не через File(...): лимит MAX_UPLOAD_FILES проверяется
+    по ходу разбора, лишние файлы не пишутся во временные.
+    """
+    async with request.form(max_files=MAX_UPLOAD_FILES, max_fields=MAX_UPLOAD_FILES) as form:
+        images = [image for image in form.getlist("images") if not isinstance(image, str)]
+        if not images:
+            raise HTTPException(status_code=422, detail="Field images is required")
+        return await run_in_threadpool(save_images, images)
+
+@app.post("/imgs/gc")
+def collect_images(db: Session = Depends(get_db)):
+    return {"removed": collect_unreferenced_images(db)}
+
+@app.post("/imgs/bundle")
+def get_image_bundle(bundle: ImageBundleRequest):
+    """Миниатюры для целой страницы карточек одним запросом вместо запроса на каждую картинку."""
+    if len(bundle.ids) > MAX_BUNDLE_IMAGES:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BUNDLE_IMAGES} images per bundle")
+    return Response(pack_image_bundle(bundle.ids, bundle.size), media_type=IMAGE_BUNDLE_MEDIA_TYPE)
 
 @app.get("/imgs/{image_id}")
-def get_image(image_id: str):
-    image_path = os.path.join(IMGS_DIR, f"{image_id}.jpg")
-    
-    if not os.path.exists(image_path):
-        if os.path.exists(DEFAULT_IMAGE_PATH):
-            return FileResponse(DEFAULT_IMAGE_PATH)
-        raise HTTPException(status_code=404, detail="Image not found")
-    
-    return FileResponse(image_path)
+def get_image(
+    image_id: str,
+    request: Request,
+    size: Optional[str] = Query(None, pattern="^(thumb|preview)$")
+):
+    if not re.fullmatch(r"[\w-]+", image_id):
+        image_id = "default"
+    entry = image_entry(image_id, size)
+    # Заглушку и ещё не обработанный оригинал кэшируем только с перепроверкой
+    cache_control = IMAGE_CACHE_CONTROL if entry.final else LIST_CACHE_CONTROL
+    headers = {"ETag": entry.etag, "Cache-Control": cache_control}
+    if etag_matches(request, entry.etag):
+        return not_modified(entry.etag, cache_control)
+
+    media_type = IMAGE_MEDIA_TYPES.get(entry.path.rsplit(".", 1)[-1])
+    if entry.data is not None:
+        return Response(entry.data, media_type=media_type, headers=headers)
+    headers["Content-Length"] = str(os.path.getsize(entry.path))
+    return StreamingResponse(iter_mapped_file(entry.path), media_type=media_type, headers=headers)
+
+def pack_image_bundle(image_ids: List[str], size: str) -> bytes:
+    """Собирает картинки в один бинарный ответ.
+
+    Оглавление: {"images": {id: {"offset", "length", "media_type", "etag", "final"}}}, смещения — от конца оглавления.
+    final=false — заглушка или картинка со старым id (не хешем содержимого): такие байты могут
+    измениться, клиенту их кэшировать нельзя. Пока миниатюра не готова (или Pillow не смог её
+    построить), вместо оригинала в пачку кладётся заглушка.
+    offset=null — байтов в пачке нет (большой файл или пачка уже заполнена), картинку запрашивают отдельно.
+    Одинаковые файлы (например, заглушка для нескольких id) кладутся один раз.
+    """
+    index, blobs, offsets = {}, [], {}
+    position = 0
+    for image_id in dict.fromkeys(image_ids):
+        key = image_id if re.fullmatch(r"[\w-]+", image_id) else "default"
+        entry = image_entry(key, size)
+        final = entry.final and bool(IMAGE_ID_RE.fullmatch(image_id))
+        if not entry.final and entry.path != DEFAULT_IMAGE_PATH:
+            entry = image_entry("default", size)
+        if entry.etag not in offsets and entry.data is not None and position + len(entry.data) <= MAX_BUNDLE_SIZE:
+            offsets[entry.etag] = (position, len(entry.data))
+            blobs.append(entry.data)
+            position += len(entry.data)
+        offset, length = offsets.get(entry.etag, (None, None))
+        index[image_id] = {
+            "offset": offset,
+            "length": length,
+            "media_type": IMAGE_MEDIA_TYPES.get(entry.path.rsplit(".", 1)[-1]),
+            "etag": entry.etag,
+            "final": final,
+        }
+    header = json.dumps({"images": index}).encode()
+    return b"".join([struct.pack(">I", len(header)), header] + blobs)
+
+def image_entry(image_id: str, size: Optional[str]) -> ImageEntry:
+    """Запись из image_cache или найденная заново; без байтов в памяти она годится, только пока файл на месте."""
+    entry = image_cache.get((image_id, size))
+    while entry is None or (entry.data is None and not os.path.exists(entry.path)):
+        entry = load_image_entry(image_id, size)
+    return entry
+
+def load_image_entry(image_id: str, size: Optional[str]) -> ImageEntry:
+    """Ищет файл картинки (или заглушку), считает ETag и кладёт результат в image_cache.
+
+    Оригинал может удалить обработка, пока его читают: тогда поиск повторяется по готовым производным.
+    """
+    generation = image_cache.generation(image_id)
+    image_path, final = find_image_file(image_id, size)
+    if not image_path:
+        if not os.path.exists(DEFAULT_IMAGE_PATH):
+            raise HTTPException(status_code=404, detail="Image not found")
+        image_path = DEFAULT_IMAGE_PATH
+
+    try:
+        data = None
+        if os.path.getsize(image_path) <= IMAGE_INLINE_MAX_SIZE:
+            with open(image_path, "rb") as f:
+                data = f.read()
+        entry = ImageEntry(image_path, file_etag(image_path), data, final)
+    except FileNotFoundError:
+        if image_path == DEFAULT_IMAGE_PATH:
+            raise
+        return load_image_entry(image_id, size)
+    image_cache.put((image_id, size), entry, generation)
+    return entry
+
+def iter_mapped_file(path: str):
+    """Отдаёт большой файл кусками из mmap: страницы читает и кэширует ОС, а не процесс."""
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        for offset in range(0, len(mapped), IMAGE_STREAM_CHUNK_SIZE):
+            yield mapped[offset:offset + IMAGE_STREAM_CHUNK_SIZE]
+
+def init_fts(connection):
+    """Полнотекстовый индекс по названиям товаров, синхронизируемый триггерами.
+
+    unicode61 приводит регистр для всего Unicode (в том числе кириллицы),
+    в отличие от встроенного NOCASE, который работает только с ASCII.
+    """
+    exists = connection.execute(
+        text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'items_fts'")
+    ).first()
+    if exists:
+        return
+
+    connection.execute(text(
+        "CREATE VIRTUAL TABLE items_fts USING fts5("
+        "name, content='items', content_rowid='id', "
+        "tokenize='unicode61 remove_diacritics 2', prefix='2 3')"
+    ))
+    connection.execute(text(
+        "CREATE TRIGGER items_fts_ai AFTER INSERT ON items BEGIN "
+        "INSERT INTO items_fts(rowid, name) VALUES (new.id, new.name); END"
+    ))
+    connection.execute(text(
+        "CREATE TRIGGER items_fts_ad AFTER DELETE ON items BEGIN "
+        "INSERT INTO items_fts(items_fts, rowid, name) VALUES ('delete', old.id, old.name); END"
+    ))
+    connection.execute(text(
+        "CREATE TRIGGER items_fts_au AFTER UPDATE OF name ON items BEGIN "
+        "INSERT INTO items_fts(items_fts, rowid, name) VALUES ('delete', old.id, old.name); "
+        "INSERT INTO items_fts(rowid, name) VALUES (new.id, new.name); END"
+    ))
+    # Индексируем товары, которые уже были в базе
+    connection.execute(text("INSERT INTO items_fts(items_fts) VALUES ('rebuild')"))
+    logger.info("Created full-text index items_fts")
+
+def init_sync(connection):
+    """Счётчик ревизий, триггеры revision/tombstones и ревизии для строк, появившихся до них."""
+    connection.execute(text("INSERT OR IGNORE INTO sync_revision (id, value) VALUES (1, 0)"))
+    connection.execute(
+        text("UPDATE sync_revision SET database_id = :database_id WHERE id = 1 AND database_id IS NULL"),
+        {"database_id": uuid.uuid4().hex}
+    )
+    for table in SYNC_COLUMNS:
+        # Старые строки нумеруются по id после текущего значения счётчика
+        base = connection.execute(text("SELECT value FROM sync_revision WHERE id = 1")).scalar()
+        updated = connection.execute(
+            text(f"UPDATE {table} SET revision = :base + id WHERE revision IS NULL"), {"base": base}
+        ).rowcount
+        if updated:
+            connection.execute(text(
+                f"UPDATE sync_revision SET value = max(value, (SELECT max(revision) FROM {table})) WHERE id = 1"
+            ))
+            logger.info(f"Assigned revisions to {updated} rows in {table}")
+
+        exists = connection.execute(
+            text("SELECT 1 FROM sqlite_master WHERE type = 'trigger' AND name = :name"),
+            {"name": f"{table}_revision_ai"}
+        ).first()
+        if exists:
+            continue
+        bump = (
+            "UPDATE sync_revision SET value = value + 1 WHERE id = 1; "
+            f"UPDATE {table} SET revision = (SELECT value FROM sync_revision WHERE id = 1) WHERE id = new.id; "
+        )
+        connection.execute(text(f"CREATE TRIGGER {table}_revision_ai AFTER INSERT ON {table} BEGIN {bump}END"))
+        # WHEN отсекает собственный UPDATE ревизии из тела триггера
+        connection.execute(text(
+            f"CREATE TRIGGER {table}_revision_au AFTER UPDATE ON {table} "
+            f"WHEN new.revision IS old.revision BEGIN {bump}END"
+        ))
+        connection.execute(text(
+            f"CREATE TRIGGER {table}_revision_ad AFTER DELETE ON {table} BEGIN "
+            "UPDATE sync_revision SET value = value + 1 WHERE id = 1; "
+            "INSERT INTO tombstones (entity, entity_id, revision) "
+            f"VALUES ('{table}', old.id, (SELECT value FROM sync_revision WHERE id = 1)); END"
+        ))
+        logger.info(f"Created revision triggers for {table}")
+
+def changelog_data_sql(table: str, row: str) -> str:
+    parts = []
+    for field in REPLICATION_FIELDS[table]:
+        if isinstance(field, tuple):
+            column, target = field
+            parts.append(f"'{column[:-3]}_uid', (SELECT uid FROM {target} WHERE id = {row}.{column})")
+        else:
+            parts.append(f"'{field}', {row}.{field}")
+    return f"json_object({', '.join(parts)})"
+
+def init_replication(connection):
+    """uid для старых строк и триггеры журнала changelog.
+
+    Пока в replication_apply есть строка, триггеры пишут её version и origin вместо
+    локальных — так применённое чужое изменение сохраняет свою версию.
+    """
+    origin = (
+        "coalesce((SELECT origin FROM replication_apply), "
+        "(SELECT database_id FROM sync_revision WHERE id = 1))"
+    )
+    for table in REPLICATION_FIELDS:
+        connection.execute(text(f"UPDATE {table} SET uid = {NEW_UID_SQL} WHERE uid IS NULL"))
+        # В таблицах, созданных до server_default у uid, сырой INSERT оставляет uid пустым:
+        # триггер его заполняет, а журнал пишет строку, когда uid уже есть
+        connection.execute(text(
+            f"CREATE TRIGGER IF NOT EXISTS {table}_uid_ai AFTER INSERT ON {table} WHEN new.uid IS NULL BEGIN "
+            f"UPDATE {table} SET uid = {NEW_UID_SQL} WHERE id = new.id; END"
+        ))
+        # Вставка тоже попадает сюда: триггер ревизий сразу выставляет revision через UPDATE
+        changelog_au = (
+            f"CREATE TRIGGER {table}_changelog_au AFTER UPDATE ON {table} "
+            "WHEN new.revision IS NOT old.revision AND new.uid IS NOT NULL BEGIN "
+            "INSERT INTO changelog (entity, uid, op, data, version, origin) "
+            f"VALUES ('{table}', new.uid, 'upsert', {changelog_data_sql(table, 'new')}, "
+            f"coalesce((SELECT version FROM replication_apply), new.revision), {origin}); END"
+        )
+        existing = connection.execute(
+            text("SELECT sql FROM sqlite_master WHERE type = 'trigger' AND name = :name"),
+            {"name": f"{table}_changelog_au"}
+        ).scalar()
+        if existing is not None:
+            if existing != changelog_au:
+                # Триггер из прежней версии схемы
+                connection.execute(text(f"DROP TRIGGER {table}_changelog_au"))
+                connection.execute(text(changelog_au))
+            continue
+
+        connection.execute(text(changelog_au))
+        connection.execute(text(
+            f"CREATE TRIGGER {table}_changelog_ad AFTER DELETE ON {table} BEGIN "
+            "UPDATE sync_revision SET value = value + 1 WHERE id = 1; "
+            "INSERT INTO changelog (entity, uid, op, data, version, origin) "
+            f"VALUES ('{table}', old.uid, 'delete', NULL, "
+            f"coalesce((SELECT version FROM replication_apply), (SELECT value FROM sync_revision WHERE id = 1)), {origin}); END"
+        ))
+        # Строки, которые были до журнала, попадают в него как есть
+        connection.execute(text(
+            "INSERT INTO changelog (entity, uid, op, data, version, origin) "
+            f"SELECT '{table}', src.uid, 'upsert', {changelog_data_sql(table, 'src')}, src.revision, "
+            f"(SELECT database_id FROM sync_revision WHERE id = 1) FROM {table} AS src ORDER BY src.revision"
+        ))
+        logger.info(f"Created changelog triggers for {table}")
+
+def add_missing_columns(connection) -> set:
+    """Добавляет в существующие таблицы колонки, появившиеся в моделях. Возвращает {(таблица, колонка)}."""
+    added = set()
+    inspector = inspect(connection)
+    for table in Base.metadata.sorted_tables:
+        existing = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            column_type = column.type.compile(dialect=connection.dialect)
+            connection.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}"))
+            added.add((table.name, column.name))
+            logger.info(f"Added column {table.name}.{column.name}")
+    return added
+
+def backfill_parameter_numeric(connection):
+    rows = connection.execute(text("SELECT id, parameter_value FROM items")).all()
+    updates = [
+        {"id": item_id, "value": parse_parameter_value(value)}
+        for item_id, value in rows
+        if parse_parameter_value(value) is not None
+    ]
+    if updates:
+        connection.execute(text("UPDATE items SET parameter_numeric = :value WHERE id = :id"), updates)
+    logger.info(f"Parsed numeric parameter values for {len(updates)} items")
+
+def backfill_updated_at(connection):
+    # Товары из базы до появления updated_at: без значения их пропускал бы фильтр since выгрузки.
+    # Время миграции — их первое известное изменение, следующая выгрузка с since отдаст их один раз
+    result = connection.execute(
+        text("UPDATE items SET updated_at = :now WHERE updated_at IS NULL"), {"now": utc_now()}
+    )
+    if result.rowcount:
+        logger.info(f"Set updated_at for {result.rowcount} items")
+
+def init_db(bind=None):
+    bind = bind or engine
+    Base.metadata.create_all(bind=bind)
+    with bind.begin() as connection:
+        added = add_missing_columns(connection)
+        if ("items", "parameter_numeric") in added:
+            backfill_parameter_numeric(connection)
+        backfill_updated_at(connection)
+    # create_all не добавляет новые индексы в уже существующие таблицы
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=bind, checkfirst=True)
+    with bind.begin() as connection:
+        init_fts(connection)
+        init_sync(connection)
+        init_replication(connection)
 
 if __name__ == "__main__":
     import uvicorn
-    Base.metadata.create_all(bind=engine)
-    uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
+    # В режиме только для чтения схема и картинки уже подготовлены там, откуда взята копия базы
+    if not STORAGE_PROFILE.get("read_only"):
+        init_db()
+        migrate_legacy_images()
+    logger.info(f"Storage profile: {STORAGE_PROFILE['preset']}")
+    with SessionLocal() as db:
+        build_suggest_index(db)
+    uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
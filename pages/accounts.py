@@ -1,32 +1,52 @@
 import flet as ft
 import requests
 from plugins.card_styles import create_card
+from plugins.api_client import subscribe_events, REQUEST_TIMEOUT
+from plugins.local_store import store
 
 API_URL = "http://127.0.0.1:8000/"
 
 def accounts_page(page: ft.Page):
-    # Загрузка данных с обработкой ошибок
+    # Загрузка данных из локальной реплики с обработкой ошибок
     def load_data():
         try:
-            roles_response = requests.get(f"{API_URL}/roles")
-            users_response = requests.get(f"{API_URL}/users")
-            
-            roles = roles_response.json() if roles_response.status_code == 200 else []
-            users = users_response.json() if users_response.status_code == 200 else []
-            
-            return roles, users
+            return store.roles(), store.users()
         except Exception as e:
             print(f"Ошибка при загрузке данных: {e}")
             return [], []
 
     # Обновление интерфейса
     def update_ui():
-        roles, users = load_data()
-        role_cards.controls = [create_role_card(r) for r in roles]
-        user_cards.controls = [create_user_card(u) for u in users]
-        role_dropdown.options = [ft.dropdown.Option(r["name"]) for r in roles]
+        state["roles"], state["users"] = load_data()
+        render()
+
+    def render():
+        role_cards.controls = [create_role_card(r) for r in state["roles"]]
+        user_cards.controls = [create_user_card(u) for u in state["users"]]
+        role_dropdown.options = [ft.dropdown.Option(r["name"]) for r in state["roles"]]
         page.update()
 
+    # Применение события из /events без перезагрузки списков; False — страница закрыта, отписаться
+    def apply_event(event):
+        if layout not in page.controls:
+            return False
+        entity, op = event["entity"], event["op"]
+        if entity not in ("roles", "users") or op == "reset":
+            if op == "reset":
+                update_ui()
+            return True
+
+        rows = [row for row in state[entity] if row["id"] != event["id"]]
+        if op == "delete" and entity == "roles":
+            # У пользователей удалённой роли роль больше не показывается
+            name = next((r["name"] for r in state["roles"] if r["id"] == event["id"]), None)
+            state["users"] = [dict(u, role=None) if u["role"] == name else u for u in state["users"]]
+        if op != "delete":
+            rows = sorted(rows + [event["data"]], key=lambda row: row["id"])
+        state[entity] = rows
+        render()
+        return True
+
     # Создание карточки роли
     def create_role_card(role):
         return create_card(
@@ -59,8 +79,8 @@ def accounts_page(page: ft.Page):
     def confirm_delete_role(e, role):
         def delete_role(_):
             try:
-                requests.delete(f"{API_URL}/roles/{role['id']}")
-                update_ui()
+                store.delete("roles", role["id"], f"/roles/{role['id']}")
+                apply_event({"entity": "roles", "op": "delete", "id": role["id"]})
                 dlg.open = False
                 page.update()
             except Exception as e:
@@ -86,8 +106,8 @@ def accounts_page(page: ft.Page):
     def confirm_delete_user(e, user):
         def delete_user(_):
             try:
-                requests.delete(f"{API_URL}/users/{user['id']}")
-                update_ui()
+                store.delete("users", user["id"], f"/users/{user['id']}")
+                apply_event({"entity": "users", "op": "delete", "id": user["id"]})
                 dlg.open = False
                 page.update()
             except Exception as e:
@@ -111,8 +131,8 @@ def accounts_page(page: ft.Page):
         def save_role(_):
             if new_role.value:
                 try:
-                    requests.post(f"{API_URL}/roles", json={"name": new_role.value})
-                    update_ui()
+                    role = store.create("roles", "/roles", {"name": new_role.value})
+                    apply_event({"entity": "roles", "op": "create", "id": role["id"], "data": role})
                     dlg.open = False
                     page.update()
                 except Exception as e:
@@ -139,7 +159,7 @@ def accounts_page(page: ft.Page):
 
         def load_roles():
             try:
-                roles = requests.get(f"{API_URL}/roles").json()
+                roles = store.roles()
                 role_dropdown.options = [ft.dropdown.Option(r["name"]) for r in roles]
                 page.update()
             except Exception as e:
@@ -150,7 +170,7 @@ def accounts_page(page: ft.Page):
         def save_user(_):
             if all([username.value, password.value, full_name.value, role_dropdown.value]):
                 try:
-                    role_id = next(r["id"] for r in requests.get(f"{API_URL}/roles").json() 
+                    role_id = next(r["id"] for r in store.roles() 
                                 if r["name"] == role_dropdown.value)
                     
                     user_data = {
@@ -160,8 +180,10 @@ def accounts_page(page: ft.Page):
                         "role_id": role_id
                     }
                     
-                    requests.post(f"{API_URL}/register", json=user_data)
-                    update_ui()
+                    # Регистрация только при связи с сервером: пароль не сохраняем в локальной очереди
+                    response = requests.post(f"{API_URL}/register", json=user_data, timeout=REQUEST_TIMEOUT)
+                    if response.ok:
+                        apply_event({"entity": "users", "op": "create", "id": response.json()["id"], "data": response.json()})
                     dlg.open = False
                     page.update()
                 except Exception as e:
@@ -185,11 +207,13 @@ def accounts_page(page: ft.Page):
         page.update()
 
     # Интерфейс
+    state = {"roles": [], "users": []}
     role_cards = ft.Column(expand=True)
     user_cards = ft.Column(expand=True)
     role_dropdown = ft.Dropdown()
 
     # Очистка страницы перед добавлением нового контента
+    store.start()
     page.clean()
     update_ui()
 
@@ -232,4 +256,6 @@ def accounts_page(page: ft.Page):
             expand=True,
             vertical_alignment=ft.CrossAxisAlignment.START
         )
-    )
\ No newline at end of file
+    )
+    layout = page.controls[-1]
+    subscribe_events(f"{API_URL}/events", apply_event)
\ No newline at end of file
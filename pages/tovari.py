@@ -1,8 +1,11 @@
 import flet as ft
 import requests
 import os
-import uuid
 from plugins.card_styles import create_card  # Импортируем универсальную карточку
+from plugins.api_client import fetch_image_bundle, subscribe_events
+from plugins.local_store import store
+
+PAGE_SIZE = 50  # Сколько товаров запрашивать за один раз
 
 class TovariPage:
     def __init__(self, page: ft.Page):
@@ -12,21 +15,31 @@ class TovariPage:
         self.selected_unit_index = 0
         self.parameter_field = None
         self.add_button = None
+        self.items = []
+        self.next_page = None  # (params, cursor) для кнопки "Показать ещё"
+        self.items_query = None  # params показанного списка товаров; None — показаны категории
+        self.root = None
+        self.search_field = None
+        self.suggestions_row = None
         self.image_picker = ft.FilePicker()
         self.page.overlay.append(self.image_picker)
         self.IMAGES_DIR = r"C:\serverShiDari\Imgs"
         os.makedirs(self.IMAGES_DIR, exist_ok=True)
         self.category_list_view = ft.ListView(controls=[], expand=True)
+        # Списки читаются из локальной реплики, она же копит изменения, пока сервер недоступен
+        store.start()
         self.tovari_interface()
+        subscribe_events("http://localhost:8000/events", self.apply_event)
 
     def tovari_interface(self):
         self.page.clean()
+        self.items_query = None
         self.page.add(
             ft.Column(
                 controls=[
                     ft.Row(
                         controls=[
-                            ft.TextField(label="Поиск товаров", on_change=self.search_items, expand=True),
+                            self.create_search_field(),
                             ft.ElevatedButton(
                                 "Добавить категорию" if not self.selected_category else "Добавить товар",
                                 on_click=self.show_add_dialog
@@ -39,6 +52,7 @@ class TovariPage:
                 expand=True
             )
         )
+        self.root = self.page.controls[0]
         self.load_categories()
 
     def load_categories(self):
@@ -48,11 +62,9 @@ class TovariPage:
         self.page.update()
 
         try:
-            response = requests.get("http://localhost:8000/categories")
-            response.raise_for_status()
-            self.categories = response.json()
+            self.categories = store.categories()
             self.update_category_list()
-        except requests.exceptions.RequestException as e:
+        except Exception as e:
             self.show_snackbar(f"Ошибка при загрузке категорий: {str(e)}")
         finally:
             # Убираем анимацию загрузки, если она есть
@@ -87,7 +99,7 @@ class TovariPage:
                     ft.Row(
                         controls=[
                             ft.ElevatedButton("Назад", on_click=lambda e: self.tovari_interface()),
-                            ft.TextField(label="Поиск товаров", on_change=self.search_items, expand=True),
+                            self.create_search_field(),
                             ft.ElevatedButton("Добавить товар", on_click=lambda e: self.show_add_item_dialog(category))
                         ],
                         alignment=ft.MainAxisAlignment.SPACE_BETWEEN
@@ -97,6 +109,7 @@ class TovariPage:
                 expand=True
             )
         )
+        self.root = self.page.controls[0]
         self.load_category_items(category)
 
     def load_category_items(self, category):
@@ -106,10 +119,7 @@ class TovariPage:
         self.page.update()
 
         try:
-            response = requests.get(f"http://localhost:8000/items?category_id={category['id']}")
-            if response.status_code == 200:
-                items = response.json()
-                self.update_item_list(items)
+            self.fetch_items_page({"category_id": category['id']})
         except Exception as e:
             self.show_snackbar(f"Ошибка при загрузке товаров: {str(e)}")
         finally:
@@ -118,14 +128,52 @@ class TovariPage:
                 self.page.controls.remove(progress_bar)
             self.page.update()
 
+    def fetch_items_page(self, params, after=None):
+        """Загрузка одной страницы товаров из локальной реплики (keyset-пагинация по id).
+
+        params: category_id — товары категории, query — поиск по названию.
+        """
+        items = store.items(
+            category_id=params.get("category_id"), query=params.get("query"), after=after, limit=PAGE_SIZE + 1
+        )
+        more = len(items) > PAGE_SIZE
+        items = items[:PAGE_SIZE]
+        self.items_query = params
+        self.items = self.items + items if after else items
+        self.next_page = (params, items[-1]['id']) if more else None
+        self.update_item_list(self.items)
+
+    def load_more_items(self, e):
+        """Подгрузка следующей страницы товаров."""
+        if not self.next_page:
+            return
+        params, cursor = self.next_page
+        try:
+            self.fetch_items_page(params, after=cursor)
+        except Exception as ex:
+            self.show_snackbar(f"Ошибка при загрузке товаров: {str(ex)}")
+
     def update_item_list(self, items):
         item_list = self.page.controls[0].controls[1]
+        images = self.load_item_images(items)
         item_list.controls = [
-            self.create_item_card(item) for item in items
+            self.create_item_card(item, images.get(item.get('image_id') or "default")) for item in items
         ]
+        if self.next_page:
+            item_list.controls.append(ft.TextButton("Показать ещё", on_click=self.load_more_items))
         self.page.update()
 
-    def create_item_card(self, item):
+    def load_item_images(self, items):
+        """Миниатюры всех карточек одним запросом; при ошибке карточки загрузят картинки сами."""
+        image_ids = [item.get('image_id') or "default" for item in items]
+        if not image_ids:
+            return {}
+        try:
+            return fetch_image_bundle("http://localhost:8000/imgs/bundle", image_ids, size="thumb")
+        except requests.exceptions.RequestException:
+            return {}
+
+    def create_item_card(self, item, image_data=None):
         """Используем универсальную карточку для товаров"""
         # Определяем изображение: если image_id отсутствует или None, используем "default"
         image_src = item['image_id'] if item.get('image_id') else "default"
@@ -135,19 +183,58 @@ class TovariPage:
             subtitle=f"{self.selected_category['parameter'] or 'Параметр'}: {item['parameter_value']}",
             description=f"Ед. измерения: {item['unit']}",
             image=image_src,
+            image_size="thumb",  # Миниатюра вместо оригинала с камеры
+            image_data=image_data,
             title_size=18,
             subtitle_size=14,
             image_width=120,
             image_height=120
         )
 
+    def create_search_field(self):
+        """Поле поиска с подсказками под ним."""
+        self.search_field = ft.TextField(
+            label="Поиск товаров",
+            on_change=self.suggest_items,
+            on_submit=self.search_items
+        )
+        self.suggestions_row = ft.Row(controls=[], wrap=True)
+        return ft.Column(controls=[self.search_field, self.suggestions_row], expand=True)
+
+    def suggest_items(self, e):
+        """Подсказки при вводе из локальной реплики: без запроса к серверу на каждое нажатие."""
+        query = e.control.value
+        if not query:
+            self.suggestions_row.controls = []
+            self.search_items(e)
+            return
+
+        try:
+            suggestions = store.suggest(query)
+        except Exception as ex:
+            print(f"Ошибка при получении подсказок: {ex}")
+            suggestions = []
+
+        self.suggestions_row.controls = [
+            ft.TextButton(s["text"], on_click=lambda e, text=s["text"]: self.apply_suggestion(text))
+            for s in suggestions
+        ]
+        self.page.update()
+
+    def apply_suggestion(self, text):
+        """Подстановка выбранной подсказки и полный поиск."""
+        self.search_field.value = text
+        self.suggestions_row.controls = []
+        self.search_items(None)
+
     def search_items(self, e):
         """Поиск товаров по запросу."""
-        query = e.control.value
+        query = self.search_field.value
         if not query:
             if self.selected_category:
                 self.load_category_items(self.selected_category)
             else:
+                self.items_query = None
                 self.load_categories()
             return
 
@@ -155,10 +242,7 @@ class TovariPage:
         self.page.update()
 
         try:
-            response = requests.get(f"http://localhost:8000/items/search?query={query}")
-            if response.status_code == 200:
-                items = response.json()
-                self.update_item_list(items)
+            self.fetch_items_page({"query": query})
         except Exception as e:
             self.show_snackbar(f"Ошибка при поиске товаров: {str(e)}")
         finally:
@@ -227,20 +311,18 @@ class TovariPage:
             parameter = self.parameter_field.value if self.parameter_field else None
             unit = ["шт.", "блок", "метр", "разн."][self.selected_unit_index]
             
-            response = requests.post(
-                "http://localhost:8000/categories",
-                json={
+            # Категория сразу появляется в реплике, на сервер уходит через очередь
+            category = store.create(
+                "categories",
+                "/categories",
+                {
                     "name": name,
                     "parameter": parameter or "Без параметра",
                     "unit": unit
                 }
             )
-            
-            if response.ok:
-                self.load_categories()
-                self.show_snackbar("Категория создана!")
-            else:
-                self.show_snackbar(f"Ошибка: {response.text}")
+            self.apply_category_event({"op": "create", "id": category["id"], "data": category})
+            self.show_snackbar("Категория создана!" if store.online else "Категория сохранена и будет отправлена на сервер")
             
             self.page.dialog.open = False
             self.parameter_field = None
@@ -299,29 +381,17 @@ class TovariPage:
             name = self.page.dialog.content.controls[0].value
             parameter_value = self.page.dialog.content.controls[2].value
 
-            if self.selected_image_path:
-                with open(self.selected_image_path, "rb") as image_file:
-                    files = {"image": (os.path.basename(self.selected_image_path), image_file)}
-                    upload_response = requests.post("http://localhost:8000/upload_image", files=files)
-                    if upload_response.status_code != 200:
-                        raise ValueError("Ошибка при загрузке изображения")
-                    image_id = upload_response.json()["image_id"]
-            else:
-                image_id = None
-
             data = {
                 "name": name,
                 "category_id": target_category['id'],
                 "parameter_value": parameter_value,
                 "unit": target_category['unit'],
-                "image_id": image_id
+                "image_id": None
             }
 
-            response = requests.post("http://localhost:8000/items", json=data)
-            if response.status_code == 200:
-                self.load_category_items(target_category)
-            else:
-                self.show_snackbar(f"Ошибка: {response.text}")
+            # Картинка загружается при отправке товара из очереди, тогда же подставляется image_id
+            item = store.create("items", "/items", data, upload_path=self.selected_image_path)
+            self.apply_item_event({"op": "create", "id": item["id"], "data": item})
 
         except Exception as ex:
             self.show_snackbar(f"Ошибка: {str(ex)}")
@@ -329,6 +399,67 @@ class TovariPage:
             self.page.dialog.open = False
             self.page.update()
 
+    def apply_event(self, event):
+        """Применение события из /events к уже показанным спискам; False — страница закрыта, отписаться."""
+        if self.root not in self.page.controls:
+            return False
+        if event["entity"] == "categories":
+            self.apply_category_event(event)
+        elif event["entity"] == "items":
+            self.apply_item_event(event)
+        elif event["op"] == "reset":
+            self.reload()
+        return True
+
+    def reload(self):
+        """Полная перезагрузка текущего списка (после reset от сервера)."""
+        if self.items_query:
+            self.fetch_items_page(self.items_query)
+        else:
+            self.load_categories()
+
+    def apply_category_event(self, event):
+        if event["op"] == "reset":
+            if not self.items_query:
+                self.load_categories()
+            return
+        self.categories = [c for c in self.categories if c['id'] != event["id"]]
+        if event["op"] != "delete":
+            self.categories.append(event["data"])
+            self.categories.sort(key=lambda c: c['id'])
+        elif self.items_query:
+            # Товары удалённой категории удалены вместе с ней
+            self.items = [item for item in self.items if item['category_id'] != event["id"]]
+            self.update_item_list(self.items)
+        if not self.items_query:
+            self.update_category_list()
+
+    def apply_item_event(self, event):
+        if not self.items_query:
+            return
+        if event["op"] == "reset":
+            self.reload()
+            return
+
+        index = next((i for i, item in enumerate(self.items) if item['id'] == event["id"]), None)
+        data = event.get("data")
+        params = self.items_query
+        # В поиске только обновляем найденные товары; в категории — следим за её составом
+        belongs = data is not None and (
+            index is not None if "query" in params else data['category_id'] == params.get("category_id")
+        )
+        if index is not None:
+            if belongs:
+                self.items[index] = data
+            else:
+                del self.items[index]
+        elif belongs and not self.next_page:
+            # Список отсортирован по id: если подгружены не все страницы, товар появится при подгрузке
+            self.items.append(data)
+        else:
+            return
+        self.update_item_list(self.items)
+
     def show_snackbar(self, message):
         """Показ уведомления."""
         self.page.snack_bar = ft.SnackBar(content=ft.Text(message))
@@ -338,4 +469,4 @@ class TovariPage:
 def tovari_page(e: ft.ControlEvent):
     """Инициализация страницы товаров."""
     page = e.page
-    TovariPage(page)
\ No newline at end of file
+    TovariPage(page)
\ No newline at end of file
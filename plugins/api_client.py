@@ -0,0 +1,165 @@
+# api_client.py
+import json
+import struct
+import threading
+import time
+import requests
+from collections import OrderedDict
+
+# msgpack необязателен: без него клиент просто получает JSON
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+MSGPACK_MEDIA_TYPE = "application/msgpack"
+# Сколько последних ответов с ETag держать для повторной проверки через If-None-Match
+ETAG_CACHE_SIZE = 128
+# Сколько миниатюр держать в памяти клиента между перерисовками списка: по числу и по байтам
+IMAGE_CACHE_SIZE = 1024
+IMAGE_CACHE_MAX_BYTES = 32 * 1024 * 1024
+# Не больше MAX_BUNDLE_IMAGES сервера за один запрос
+BUNDLE_SIZE = 200
+# Таймауты соединения и чтения для обычных запросов: без них зависший сервер вешает интерфейс
+REQUEST_TIMEOUT = (5, 30)
+
+# Пауза перед переподключением к ленте изменений и таймаут чтения (сервер шлёт keep-alive раз в 15 с)
+EVENTS_RECONNECT_SECONDS = 3
+EVENTS_READ_TIMEOUT = 60
+
+# Одна сессия на всё приложение: keep-alive между запросами,
+# Accept-Encoding (gzip, а при установленном brotli и br) requests добавляет сам
+session = requests.Session()
+session.headers["Accept"] = (
+    f"{MSGPACK_MEDIA_TYPE}, application/json;q=0.9" if msgpack is not None else "application/json"
+)
+
+# Последние ответы с ETag: при 304 Not Modified отдаём сохранённый ответ
+_etag_cache = OrderedDict()
+# Байты уже полученных окончательных картинок по (id, size); id картинки — хеш содержимого,
+# поэтому они не устаревают. Заглушки и ещё не готовые миниатюры не кэшируются
+_image_cache = OrderedDict()
+_image_cache_bytes = 0
+
+# Обработчики событий /events и фоновый поток, который их читает (один на приложение)
+_event_handlers = []
+_event_handlers_lock = threading.Lock()
+_events_thread = None
+
+# Функция GET-запроса к API с компактной кодировкой ответа и условным запросом по ETag
+def api_get(url, params=None, **kwargs):
+    full_url = requests.Request("GET", url, params=params).prepare().url
+    headers = dict(kwargs.pop("headers", None) or {})
+    cached = _etag_cache.get(full_url)
+    if cached is not None:
+        headers["If-None-Match"] = cached.headers["ETag"]
+
+    kwargs.setdefault("timeout", REQUEST_TIMEOUT)
+    response = session.get(full_url, headers=headers, **kwargs)
+    if response.status_code == 304 and cached is not None:
+        _etag_cache.move_to_end(full_url)
+        return cached
+    if response.status_code == 200 and "ETag" in response.headers:
+        _etag_cache[full_url] = response
+        _etag_cache.move_to_end(full_url)
+        while len(_etag_cache) > ETAG_CACHE_SIZE:
+            _etag_cache.popitem(last=False)
+    return response
+
+# Функция разбора ответа: MessagePack или JSON по Content-Type
+def decode_response(response):
+    content_type = response.headers.get("content-type", "")
+    if msgpack is not None and content_type.startswith(MSGPACK_MEDIA_TYPE):
+        return msgpack.unpackb(response.content, raw=False)
+    return response.json()
+
+# Функция получения картинок пачкой: один POST /imgs/bundle вместо запроса на каждую карточку
+def fetch_image_bundle(url, image_ids, size="thumb"):
+    global _image_cache_bytes
+    images = {}
+    wanted = [image_id for image_id in dict.fromkeys(image_ids) if (image_id, size) not in _image_cache]
+    for start in range(0, len(wanted), BUNDLE_SIZE):
+        response = session.post(
+            url, json={"ids": wanted[start:start + BUNDLE_SIZE], "size": size}, timeout=REQUEST_TIMEOUT
+        )
+        response.raise_for_status()
+        for image_id, entry in unpack_image_bundle(response.content).items():
+            if entry["data"] is None:
+                # Байтов в пачке нет: карточка загрузит картинку сама по URL
+                continue
+            images[image_id] = entry["data"]
+            if entry.get("final"):
+                _image_cache[(image_id, size)] = entry["data"]
+                _image_cache_bytes += len(entry["data"])
+    while _image_cache and (len(_image_cache) > IMAGE_CACHE_SIZE or _image_cache_bytes > IMAGE_CACHE_MAX_BYTES):
+        _, data = _image_cache.popitem(last=False)
+        _image_cache_bytes -= len(data)
+
+    for image_id in image_ids:
+        data = _image_cache.get((image_id, size))
+        if data is not None:
+            _image_cache.move_to_end((image_id, size))
+            images[image_id] = data
+    return images
+
+# Функция разбора пачки: 4 байта длины оглавления, JSON-оглавление, затем байты картинок.
+# Возвращает {id: запись оглавления с байтами картинки в "data"}; data=None, если байтов в пачке нет
+def unpack_image_bundle(content):
+    (header_length,) = struct.unpack(">I", content[:4])
+    index = json.loads(content[4:4 + header_length])["images"]
+    body = memoryview(content)[4 + header_length:]
+    return {
+        image_id: dict(
+            entry,
+            data=bytes(body[entry["offset"]:entry["offset"] + entry["length"]]) if entry["offset"] is not None else None
+        )
+        for image_id, entry in index.items()
+    }
+
+# Функция подписки на ленту изменений сервера (Server-Sent Events).
+# handler(event) вызывается в фоновом потоке; вернув False, обработчик отписывается
+def subscribe_events(url, handler):
+    global _events_thread
+    with _event_handlers_lock:
+        _event_handlers.append(handler)
+        if _events_thread is None:
+            _events_thread = threading.Thread(target=_listen_events, args=(url,), daemon=True)
+            _events_thread.start()
+
+# Функция рассылки события обработчикам; локальная реплика шлёт через неё и свои события
+def dispatch_event(event):
+    with _event_handlers_lock:
+        handlers = list(_event_handlers)
+    for handler in handlers:
+        try:
+            keep = handler(event)
+        except Exception as e:
+            print(f"Ошибка при обработке события: {e}")
+            keep = True
+        if keep is False:
+            with _event_handlers_lock:
+                _event_handlers.remove(handler)
+
+# Чтение потока с переподключением; Last-Event-ID позволяет получить пропущенные события
+def _listen_events(url):
+    last_event_id = None
+    while True:
+        headers = {"Accept": "text/event-stream"}
+        if last_event_id:
+            headers["Last-Event-ID"] = last_event_id
+        try:
+            with requests.get(url, headers=headers, stream=True, timeout=(5, EVENTS_READ_TIMEOUT)) as response:
+                event_id, data = None, []
+                # chunk_size=None: строки отдаются по мере прихода, без ожидания заполнения буфера
+                for line in response.iter_lines(chunk_size=None, decode_unicode=True):
+                    if line.startswith("id:"):
+                        event_id = line[3:].strip()
+                    elif line.startswith("data:"):
+                        data.append(line[5:].strip())
+                    elif not line and data:
+                        last_event_id = event_id or last_event_id
+                        dispatch_event(json.loads("\n".join(data)))
+                        event_id, data = None, []
+        except requests.exceptions.RequestException:
+            pass
+        time.sleep(EVENTS_RECONNECT_SECONDS)
@@ -1,3 +1,4 @@
+import base64
 import flet as ft
 
 def create_card(
@@ -19,6 +20,8 @@ def create_card(
     description_color: str = ft.colors.BLUE_800,
     image_width: int = 100,
     image_height: int = 100,
+    image_size: str = None,
+    image_data: bytes = None,
     base_image_url: str = "http://localhost:8000/imgs/"
 ) -> ft.Card:
     """
@@ -41,13 +44,24 @@ def create_card(
     :param description_color: Цвет описания
     :param image_width: Ширина изображения
     :param image_height: Высота изображения
+    :param image_size: Размер копии с сервера: "thumb" или "preview" (по умолчанию оригинал)
+    :param image_data: Уже загруженные байты изображения (например, из пачки /imgs/bundle); тогда запрос по URL не делается
     :param base_image_url: Базовый URL для изображений
     :return: Объект ft.Card
     """
     # Обработка изображения
     image_control = None
-    if image:
+    if image_data:
+        image_control = ft.Image(
+            src_base64=base64.b64encode(image_data).decode(),
+            width=image_width,
+            height=image_height,
+            fit=ft.ImageFit.COVER
+        )
+    elif image:
         full_image_src = f"{base_image_url}{image}" if not image.startswith(("http://", "https://")) else image
+        if image_size and not image.startswith(("http://", "https://")):
+            full_image_src += f"?size={image_size}"
         image_control = ft.Image(
             src=full_image_src,
             width=image_width,
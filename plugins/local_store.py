@@ -0,0 +1,388 @@
+# local_store.py
+import json
+import os
+import re
+import sqlite3
+import threading
+import uuid
+import requests
+from plugins.api_client import api_get, decode_response, session, subscribe_events, dispatch_event, REQUEST_TIMEOUT
+
+API_URL = "http://localhost:8000"
+
+# Реплика лежит рядом с остальными настройками клиента
+SERVER_DIR = r"C:\serverShiDari"
+os.makedirs(SERVER_DIR, exist_ok=True)
+REPLICA_PATH = os.path.join(SERVER_DIR, "local_replica.db")
+
+# Как часто пробовать достучаться до сервера без связи и как часто сверяться при связи
+# (при связи изменения приходят через /events, периодическая сверка — подстраховка)
+OFFLINE_RETRY_SECONDS = 5
+ONLINE_SYNC_SECONDS = 60
+# Сколько раз подряд изменение может получить 5xx, прежде чем оно уйдёт в outbox_failed
+# и перестанет держать остальную очередь
+MAX_OUTBOX_ATTEMPTS = 5
+
+# Таблицы реплики и их колонки в том виде, в каком их отдаёт /sync
+REPLICA_COLUMNS = {
+    "roles": ["id", "name", "revision"],
+    "users": ["id", "username", "full_name", "role_id", "revision"],
+    "categories": ["id", "name", "parameter", "unit", "revision"],
+    "items": ["id", "name", "category_id", "parameter_value", "parameter_numeric", "unit", "image_id", "revision"],
+}
+# Поля запросов, ссылающиеся на другие таблицы: временный id заменяется настоящим после отправки
+REFERENCES = {"category_id": "categories", "role_id": "roles"}
+# Сколько подсказок показывать под полем поиска
+SUGGEST_LIMIT = 10
+# Таблицы с полнотекстовым индексом по name, как items_fts на сервере
+FTS_TABLES = ["categories", "items"]
+
+
+def _fts_words(text):
+    """Слова ввода для MATCH FTS5: в кавычках, чтобы знаки и операторы FTS не ломали запрос."""
+    return [f'"{word}"' for word in re.findall(r"\w+", text.casefold())]
+
+
+class LocalStore:
+    """Локальная копия каталога и ролей в SQLite и очередь изменений (outbox).
+
+    Чтение всегда идёт из реплики и не требует сети. Изменения сразу применяются
+    к реплике (новые строки получают временные отрицательные id) и записываются
+    в outbox; фоновый поток отправляет их на сервер по порядку, когда он доступен,
+    и подтягивает чужие изменения через /sync.
+    """
+
+    def __init__(self, path: str):
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.lock = threading.RLock()
+        # Отправка очереди из двух потоков сразу отправила бы одно изменение дважды
+        self.refresh_lock = threading.Lock()
+        self.wake = threading.Event()
+        self.online = False
+        self.thread = None
+        self._create_schema()
+
+    def _create_schema(self):
+        with self.lock, self.conn:
+            for table, columns in REPLICA_COLUMNS.items():
+                fields = ", ".join(f"{column} INTEGER PRIMARY KEY" if column == "id" else column for column in columns)
+                self.conn.execute(f"CREATE TABLE IF NOT EXISTS {table} ({fields})")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS ix_items_category_id_id ON items (category_id, id)")
+            for table in FTS_TABLES:
+                self._create_fts(table)
+            self.conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value)")
+            # op_id уходит на сервер в Idempotency-Key: повтор запроса с потерянным ответом не создаёт дубль
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS outbox ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, method TEXT, path TEXT, body TEXT, "
+                "entity TEXT, temp_id INTEGER, upload_path TEXT, op_id TEXT, attempts INTEGER DEFAULT 0)"
+            )
+            existing = {row["name"] for row in self.conn.execute("PRAGMA table_info(outbox)")}
+            for column, column_type in (("op_id", "TEXT"), ("attempts", "INTEGER DEFAULT 0")):
+                if column not in existing:
+                    self.conn.execute(f"ALTER TABLE outbox ADD COLUMN {column} {column_type}")
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS outbox_failed ("
+                "id INTEGER PRIMARY KEY, method TEXT, path TEXT, body TEXT, entity TEXT, "
+                "op_id TEXT, status INTEGER, response TEXT)"
+            )
+
+    def _create_fts(self, table):
+        """Индекс FTS5 по названиям, синхронизируемый триггерами, как items_fts на сервере.
+
+        unicode61 приводит регистр для всего Unicode, в отличие от lower() SQLite.
+        Строки из /sync применяются через UPSERT: INSERT OR REPLACE не вызывает триггер удаления.
+        """
+        exists = self.conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (f"{table}_fts",)
+        ).fetchone()
+        if exists:
+            return
+        fts = f"{table}_fts"
+        self.conn.execute(
+            f"CREATE VIRTUAL TABLE {fts} USING fts5("
+            f"name, content='{table}', content_rowid='id', "
+            "tokenize='unicode61 remove_diacritics 2', prefix='2 3')"
+        )
+        self.conn.execute(
+            f"CREATE TRIGGER {fts}_ai AFTER INSERT ON {table} BEGIN "
+            f"INSERT INTO {fts}(rowid, name) VALUES (new.id, new.name); END"
+        )
+        self.conn.execute(
+            f"CREATE TRIGGER {fts}_ad AFTER DELETE ON {table} BEGIN "
+            f"INSERT INTO {fts}({fts}, rowid, name) VALUES ('delete', old.id, old.name); END"
+        )
+        self.conn.execute(
+            f"CREATE TRIGGER {fts}_au AFTER UPDATE OF name ON {table} BEGIN "
+            f"INSERT INTO {fts}({fts}, rowid, name) VALUES ('delete', old.id, old.name); "
+            f"INSERT INTO {fts}(rowid, name) VALUES (new.id, new.name); END"
+        )
+        # Индексируем строки, которые уже были в реплике
+        self.conn.execute(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')")
+
+    def _meta(self, key, default=None):
+        row = self.conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else default
+
+    def _set_meta(self, key, value):
+        self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+
+    def start(self):
+        """Запуск фонового потока; повторные вызовы ничего не делают.
+
+        Первая синхронизация идёт уже в потоке: страницы сразу показывают реплику,
+        а после синхронизации получают reset и перечитывают списки.
+        """
+        with self.lock:
+            if self.thread is not None:
+                return
+            self.thread = threading.Thread(target=self._run, daemon=True)
+        subscribe_events(f"{API_URL}/events", self._on_event)
+        self.thread.start()
+
+    def _run(self):
+        with self.lock:
+            revision = self._meta("revision", 0)
+        if self.refresh():
+            with self.lock:
+                changed = self._meta("revision", 0) != revision
+            if changed:
+                dispatch_event({"entity": None, "op": "reset", "id": None, "revision": None})
+        while True:
+            self.wake.wait(ONLINE_SYNC_SECONDS if self.online else OFFLINE_RETRY_SECONDS)
+            self.wake.clear()
+            self.refresh()
+
+    def _on_event(self, event):
+        # У reset без ревизии (после первой синхронизации) реплика уже свежая
+        if event["op"] == "reset" and event["revision"] is not None:
+            # Страницы перечитают списки из реплики сразу после этого обработчика
+            self.refresh()
+        elif event["op"] != "reset":
+            self.wake.set()
+        return True
+
+    def refresh(self) -> bool:
+        """Отправляет накопленные изменения и подтягивает новые с сервера. False — сервер недоступен."""
+        with self.refresh_lock:
+            try:
+                self.online = self.flush_outbox() and self.sync()
+            except requests.exceptions.RequestException:
+                self.online = False
+            return self.online
+
+    # Чтение
+    def _rows(self, query, params=()):
+        with self.lock:
+            return [dict(row) for row in self.conn.execute(query, params)]
+
+    def categories(self):
+        return self._rows("SELECT id, name, parameter, unit FROM categories ORDER BY id")
+
+    def items(self, category_id=None, query=None, after=None, limit=50):
+        """Страница товаров по id: все, в категории или со словами, начинающимися со слов запроса."""
+        source, key, conditions, params = "items", "items.id", [], []
+        if query:
+            words = _fts_words(query)
+            if not words:
+                return []
+            # CROSS JOIN оставляет индекс внешним циклом: совпадения идут в порядке rowid,
+            # и выборка останавливается на limit, а не собирает все совпадения
+            source, key = "items_fts CROSS JOIN items ON items.id = items_fts.rowid", "items_fts.rowid"
+            conditions.append("items_fts MATCH ?")
+            params.append(" ".join(f"{word}*" for word in words))
+        if category_id is not None:
+            conditions.append("category_id = ?")
+            params.append(category_id)
+        if after is not None:
+            conditions.append(f"{key} > ?")
+            params.append(after)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        return self._rows(
+            "SELECT items.id, items.name, category_id, parameter_value, parameter_numeric, unit, image_id "
+            f"FROM {source} {where} ORDER BY {key} LIMIT ?",
+            params + [limit]
+        )
+
+    def suggest(self, prefix, limit=SUGGEST_LIMIT):
+        """Подсказки по началу слова в названиях категорий и товаров, как /items/suggest, но без сети.
+
+        Слова ввода ищутся фразой подряд, последнее — как префикс.
+        """
+        words = _fts_words(prefix)
+        if not words:
+            return []
+        match = f"{' + '.join(words)} *"
+        return self._rows(
+            "SELECT name AS text, 'category' AS kind, rowid AS id FROM categories_fts WHERE categories_fts MATCH ? "
+            "UNION ALL "
+            "SELECT name AS text, 'item' AS kind, rowid AS id FROM items_fts WHERE items_fts MATCH ? "
+            "LIMIT ?",
+            (match, match, limit)
+        )
+
+    def roles(self):
+        return self._rows("SELECT id, name FROM roles ORDER BY id")
+
+    def users(self):
+        return self._rows(
+            "SELECT users.id, username, full_name, roles.name AS role "
+            "FROM users LEFT JOIN roles ON roles.id = users.role_id ORDER BY users.id"
+        )
+
+    # Изменения
+    def create(self, entity, path, data, upload_path=None):
+        """Добавляет строку в реплику с временным id и ставит POST в очередь. Возвращает строку."""
+        with self.lock, self.conn:
+            temp_id = self._meta("next_temp_id", -1)
+            self._set_meta("next_temp_id", temp_id - 1)
+            row = {column: data.get(column) for column in REPLICA_COLUMNS[entity]}
+            row["id"] = temp_id
+            self.conn.execute(
+                f"INSERT INTO {entity} ({', '.join(row)}) VALUES ({', '.join('?' for _ in row)})",
+                list(row.values())
+            )
+            self.conn.execute(
+                "INSERT INTO outbox (method, path, body, entity, temp_id, upload_path, op_id) "
+                "VALUES ('POST', ?, ?, ?, ?, ?, ?)",
+                (path, json.dumps(data), entity, temp_id, upload_path, uuid.uuid4().hex)
+            )
+        self.wake.set()
+        row.pop("revision", None)
+        return row
+
+    def delete(self, entity, entity_id, path):
+        """Удаляет строку из реплики; если она ещё не отправлена, просто убирает её создание из очереди."""
+        with self.lock, self.conn:
+            self.conn.execute(f"DELETE FROM {entity} WHERE id = ?", (entity_id,))
+            if entity == "categories":
+                self.conn.execute("DELETE FROM items WHERE category_id = ?", (entity_id,))
+            if entity_id < 0:
+                self.conn.execute("DELETE FROM outbox WHERE entity = ? AND temp_id = ?", (entity, entity_id))
+                for field, target in REFERENCES.items():
+                    if target == entity:
+                        self.conn.execute(f"DELETE FROM outbox WHERE json_extract(body, '$.{field}') = ?", (entity_id,))
+            else:
+                self.conn.execute(
+                    "INSERT INTO outbox (method, path, body, entity, op_id) VALUES ('DELETE', ?, NULL, ?, ?)",
+                    (path, entity, uuid.uuid4().hex)
+                )
+        self.wake.set()
+
+    def pending(self) -> int:
+        with self.lock:
+            return self.conn.execute("SELECT count(*) FROM outbox").fetchone()[0]
+
+    def flush_outbox(self) -> bool:
+        """Отправляет очередь по порядку. False — сервер недоступен или ответил ошибкой 5xx, отправка прервана.
+
+        Изменение, на которое сервер MAX_OUTBOX_ATTEMPTS раз подряд ответил 5xx, переносится
+        в outbox_failed, и отправка продолжается со следующего.
+        """
+        while True:
+            with self.lock:
+                entry = self.conn.execute("SELECT * FROM outbox ORDER BY id LIMIT 1").fetchone()
+            if entry is None:
+                return True
+
+            body = json.loads(entry["body"]) if entry["body"] else None
+            headers = {"Idempotency-Key": entry["op_id"]} if entry["op_id"] else {}
+            response = None
+            if entry["upload_path"] and os.path.exists(entry["upload_path"]):
+                with open(entry["upload_path"], "rb") as image_file:
+                    files = {"image": (os.path.basename(entry["upload_path"]), image_file)}
+                    upload = session.post(f"{API_URL}/upload_image", files=files, timeout=REQUEST_TIMEOUT)
+                if upload.status_code >= 500:
+                    response = upload
+                elif upload.ok:
+                    body["image_id"] = upload.json()["image_id"]
+            if response is None:
+                response = session.request(
+                    entry["method"], f"{API_URL}{entry['path']}", json=body, headers=headers, timeout=REQUEST_TIMEOUT
+                )
+            if response.status_code >= 500:
+                if not self._give_up(entry, response):
+                    return False
+            elif not response.ok and response.status_code != 404:
+                # Сервер отклонил изменение (например, имя уже занято): повторять бессмысленно
+                print(f"Изменение {entry['method']} {entry['path']} отклонено сервером: {response.text}")
+
+            with self.lock, self.conn:
+                self.conn.execute("DELETE FROM outbox WHERE id = ?", (entry["id"],))
+                if entry["temp_id"] is not None:
+                    self._replace_temp_id(entry["entity"], entry["temp_id"], response.json()["id"] if response.ok else None)
+            if entry["temp_id"] is not None:
+                # Настоящая строка придёт через /sync и /events, временную страницы убирают
+                dispatch_event({"entity": entry["entity"], "op": "delete", "id": entry["temp_id"], "revision": None})
+
+    def _give_up(self, entry, response) -> bool:
+        """Считает неудачную попытку; True — попытки кончились, изменение сохранено в outbox_failed."""
+        with self.lock, self.conn:
+            attempts = (entry["attempts"] or 0) + 1
+            if attempts < MAX_OUTBOX_ATTEMPTS:
+                self.conn.execute("UPDATE outbox SET attempts = ? WHERE id = ?", (attempts, entry["id"]))
+                return False
+            self.conn.execute(
+                "INSERT INTO outbox_failed (id, method, path, body, entity, op_id, status, response) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (entry["id"], entry["method"], entry["path"], entry["body"], entry["entity"], entry["op_id"],
+                 response.status_code, response.text)
+            )
+        print(f"Изменение {entry['method']} {entry['path']} не принято после {attempts} попыток: {response.text}")
+        return True
+
+    def _replace_temp_id(self, entity, temp_id, real_id):
+        self.conn.execute(f"DELETE FROM {entity} WHERE id = ?", (temp_id,))
+        for field, target in REFERENCES.items():
+            if target != entity:
+                continue
+            # Ссылки из ещё не отправленных изменений и из строк реплики
+            if real_id is None:
+                self.conn.execute(f"DELETE FROM outbox WHERE json_extract(body, '$.{field}') = ?", (temp_id,))
+            else:
+                self.conn.execute(
+                    f"UPDATE outbox SET body = json_set(body, '$.{field}', ?) WHERE json_extract(body, '$.{field}') = ?",
+                    (real_id, temp_id)
+                )
+            for table, columns in REPLICA_COLUMNS.items():
+                if field in columns:
+                    self.conn.execute(f"UPDATE {table} SET {field} = ? WHERE {field} = ?", (real_id, temp_id))
+
+    def sync(self) -> bool:
+        """Подтягивает изменения после последней известной ревизии (страницами, пока more=true)."""
+        while True:
+            with self.lock:
+                database_id, since = self._meta("database"), self._meta("revision", 0)
+            response = api_get(f"{API_URL}/sync", params={"since": since})
+            if response.status_code != 200:
+                return False
+            changes = decode_response(response)
+
+            with self.lock, self.conn:
+                if changes["database"] != database_id:
+                    # Сервер работает с другой базой: реплику собираем заново
+                    if database_id is not None:
+                        for table in REPLICA_COLUMNS:
+                            self.conn.execute(f"DELETE FROM {table} WHERE id > 0")
+                        self._set_meta("database", changes["database"])
+                        self._set_meta("revision", 0)
+                        continue
+                    self._set_meta("database", changes["database"])
+                for table, ids in changes["deletes"].items():
+                    self.conn.executemany(f"DELETE FROM {table} WHERE id = ?", [(entity_id,) for entity_id in ids])
+                for table, rows in changes["upserts"].items():
+                    columns = REPLICA_COLUMNS[table]
+                    updates = ", ".join(f"{column} = excluded.{column}" for column in columns if column != "id")
+                    self.conn.executemany(
+                        f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' for _ in columns)}) "
+                        f"ON CONFLICT (id) DO UPDATE SET {updates}",
+                        [[row.get(column) for column in columns] for row in rows]
+                    )
+                self._set_meta("revision", changes["revision"])
+            if not changes["more"]:
+                return True
+
+
+# Одна реплика на всё приложение
+store = LocalStore(REPLICA_PATH)